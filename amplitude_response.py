@@ -5,15 +5,16 @@ import json
 
 import numpy as np
 
-from src.misc import ad9910_sweep_bandwidth, ad9910_inv_sinc, parse_numeric_expr, parse_time_expr, parse_freq_expr, roll_lerp, ddc_cost_mv
+from src.misc import ad9910_sweep_bandwidth, ad9910_inv_sinc, parse_numeric_expr, parse_time_expr, parse_freq_expr, roll_lerp, ddc_cost_mv, BinAccumulator, frequency_bins
 from src.delay import SpectralDelayEstimator
 from src.display import minmaxplot, page
 from src.touchstone import S2PFile
-from src.orda import StreamORDA
+from src.session import CaptureSet, stream_session, follow_batches
+from src.cache import ArrayCache
 import src.delay as delay
 import src.dds as dds
 
-from src.workflows.v1 import ModelSignalV1
+from src.workflows import load_models
 from src.schemas.v1 import *
 
 class Mode(Enum):
@@ -55,55 +56,28 @@ class FrequencyResponsePointsV1:
 				- Above 0.95*duration
 				- To remove transients
 		- Apply pooling
-			- Join and sort
+			- Fold into per-bin accumulators
 			- Deals with overlap
 	"""
 
-	def __init__(self, location, trim=0.05, attenuation=1.0):
+	def __init__(self, location, trim=0.05, attenuation=1.0, dtype=np.complex128, bin_width=10000, stream=False, follow=False, cache=None):
 		with open(f"{location}/preset.json") as f:
 			obj = json.load(f)
 
-		preset = JsonDDCAndCalibratorV1.deserialize(obj["ddc-and-calibrator-v1"])
-
-		captures = []
-
-		# No streaming, just load it all
-		# Will take up some RAM
-		#################################################################################################
-		for filename in sorted(glob(f"{location}/*.ISE")):
-			with open(filename, "rb") as f:
-				for capture in StreamORDA(f).captures:
-					if capture.center_freq == 0:
-						continue # DDC quirk: 0 Hz must be skipped
-
-					captures.append(capture)
-
-		chan_set = set([x.channel_number for x in captures])
-
-		print("Loaded", len(captures), "captures")
-		print(len(chan_set), "channels active")
+		# V1 or V2 preset
+		preset, signals = load_models(obj, cache=cache)
 
 		# Point storage for:
-		# - ADC's perceived level, channel wise, across frequencies
 		# - Model level, across frequencies
-		adc_ch_x = { chan: [] for chan in chan_set }
-		adc_ch_y = { chan: [] for chan in chan_set }
-
+		# - ADC's perceived level, channel wise, across frequencies - see update()
 		model_x = []
 		model_y = []
 
-		signals = []
-
-		for descriptor in preset.signals:
-			signals.append( ModelSignalV1(descriptor, preset.ddc) )
-
-		# Keep track of what pulses had the most captures
-		max_h = 0
-
-		# First pass over the data
-		# Pulse modelling + filtering + delay elimination
+		# Pulse modelling + cropping
 		#################################################################################################
-		for i, signal in enumerate(signals):
+		crops = []
+
+		for signal in signals:
 			tune = parse_freq_expr(signal.descriptor.tune)
 
 			# Pulse cropping
@@ -118,108 +92,118 @@ class FrequencyResponsePointsV1:
 
 			model_x.append(x)
 			model_y.append(y)
+			crops.append(indices)
 
-			# Deal with channels and repeated captures
-			for channel in chan_set:
-				filter_fn = lambda x: x.center_freq == tune and x.channel_number == channel
-				repeats = list(filter(filter_fn, captures))
-
-				x = signal.temporal_freq[indices] + tune
-				y = np.vstack(
-					[signal.eliminate_delay(x.iq)[indices] for x in repeats]
-				)
+		# Binning
+		# For a sweep's 849 frequency points
+		# There will be 848 bins; v2 chips get a bin around each distinct frequency
+		edges, rows, centers = frequency_bins(np.hstack(model_x), bin_width)
 
-				adc_ch_x[channel].append(x)
-				adc_ch_y[channel].append(y)
+		# Same for every channel
+		# Points outside the bins are dropped
+		bins = [np.digitize(x, edges) - 1 for x in model_x]
 
-				if len(repeats) > max_h:
-					max_h = len(repeats)
-
-		# Second pass over the data to pool it, sort and bin it
-		# Some pulses may have less captures than others; this is deat with:
-		# - By zero padding
-		# - And a mask
-		#
-		# Total memory utilization per channel is in the ballpark of:
-		# - Captures:
-		#	Five minute session
-		#	25 captures per second
-		#	4096 samples per capture
-		#	complex128 samples = 16 bytes
-		#	about 491 MB
+		# Pass over the data
+		# Filtering + delay elimination + pooling
 		#
-		# - Mask:
-		#	bools = 1 byte
-		#	about 30 MB
+		# Captures are folded into per-bin sum/min/max/count as they are decoded,
+		# so memory stays O(bins) instead of O(captures * samples)
 		#################################################################################################
-		for chan in chan_set:
-			# x will stack no problem
-			# y needs padding
+		self.signals = signals
+		self.crops = crops
+		self.bins = bins
+		self.signal_x = model_x
+		self.edges = edges
+		self.rows = rows
+		self.centers = centers
+		self.lookup = { parse_freq_expr(signal.descriptor.tune): i for i, signal in enumerate(signals) }
+		self.accumulators = {}
+		self.count = 0
+
+		self.model_x = np.hstack(model_x)
+		self.model_y = np.hstack(model_y)
 
-			x = np.hstack(adc_ch_x[chan]) # Frequency values
-			y = [] # Amplitude values
-			m = [] # Legitimate/padding mask
+		self.attenuation = attenuation
 
-			for pulse in adc_ch_y[chan]:
-				h, w = pulse.shape
-				u = np.zeros([max_h, w], dtype=np.complex128)
-				v = np.zeros([max_h, w], dtype=np.bool)
+		if follow:
+			# Nothing is read here, the caller feeds batches through fold() as they arrive
+			assert len(self.lookup) == len(signals), "--follow needs every signal to have its own tune"
+		elif stream:
+			# Walk the files once, a batch at a time; nothing but the batch at hand is kept
+			# Memory does not depend on session length
+			assert len(self.lookup) == len(signals), "--stream needs every signal to have its own tune"
 
-				u[:h] = pulse
-				v[:h] = True
+			for batch in stream_session(location, dtype=dtype):
+				self.fold(batch)
 
-				y.append(u)
-				m.append(v)
+			print("Streamed", self.count, "captures")
+			print(len(self.accumulators), "channels active")
+		else:
+			# Index the captures, decode only what gets queried
+			captures = CaptureSet(location)
+			captures = captures[captures.center_freq != 0] # DDC quirk: 0 Hz must be skipped
 
-			y = np.abs(np.hstack(y))
-			m = np.hstack(m)
+			self.accumulators = { chan: BinAccumulator(edges) for chan in captures.channels }
+			self.count = len(captures)
 
-			# Sort so frequency is monotonic
-			x, indices = np.sort(x), np.argsort(x)
-			y = y[:, indices]
-			m = m[:, indices]
+			print("Loaded", len(captures), "captures")
+			print(len(self.accumulators), "channels active")
 
-			# Binning
-			roundto = 10000
-			repeat = np.round(x/roundto)*roundto
-			unique, indices = np.unique(repeat, return_index=True)
+			# One (channel, tune) group at a time
+			for i, signal in enumerate(signals):
+				tune = parse_freq_expr(signal.descriptor.tune)
 
-			# Digitize assigns index of 0 to values that are out-of-bounds
-			# e.g. fall outside the lowest bin
-			indices = np.digitize(x, unique)
+				# Deal with channels and repeated captures
+				for channel in self.accumulators:
+					repeats = captures.select(channel=channel, center_freq=tune)
 
-			assert not np.any(indices == 0), "bin bugcheck"
+					# No captures, e.g. the run was stopped early
+					if len(repeats) == 0:
+						continue
 
-			mampl = []
-			lower = []
-			upper = []
+					y = signal.eliminate_delay_batch( repeats.iq(dtype) )[:, crops[i]]
 
-			for i in range( 1, len(unique) ):
-				ind1 = np.where(indices == i)
-				sub1 = y[:, ind1]
-				mub1 = m[:, ind1]
+					self.accumulators[channel].add(model_x[i], np.abs(y), bins[i])
 
-				ind2 = np.where(mub1)
-				bin = sub1[ind2]
+		self.update()
 
-				mampl.append(np.mean(bin))
-				lower.append(np.min(bin))
-				upper.append(np.max(bin))
+	def fold(self, batch):
+		"""
+		Fold an ORDABatch into the per-bin accumulators, call update() to see the result
 
-			# For 849 frequency points
-			# There will be 848 bins
-			# Align frequencies to bin centers
-			adc_ch_x[chan] = unique[1:] - roundto/2
-			adc_ch_y[chan] = mampl
+		Captures at tunes not in the preset are skipped, which covers the DDC's 0 Hz quirk
+		"""
 
-		self.adc_ch_x = adc_ch_x
-		self.adc_ch_y = adc_ch_y
-		self.chan_set = chan_set
+		for tune in np.unique(batch.center_freq):
+			if tune not in self.lookup:
+				continue
 
-		self.model_x = np.hstack(model_x)
-		self.model_y = np.hstack(model_y)
+			i = self.lookup[tune]
+			rows = batch.center_freq == tune
 
-		self.attenuation = attenuation
+			y = np.abs( self.signals[i].eliminate_delay_batch(batch.iq[rows])[:, self.crops[i]] )
+			channels = batch.channel_number[rows]
+
+			for channel in np.unique(channels).tolist():
+				if channel not in self.accumulators:
+					self.accumulators[channel] = BinAccumulator(self.edges)
+
+				self.accumulators[channel].add(self.signal_x[i], y[channels == channel], self.bins[i])
+
+			self.count += int(np.sum(rows))
+
+	def update(self):
+		"""
+		Turn the accumulators into the channel wise points
+		"""
+
+		self.chan_set = set(self.accumulators)
+		self.adc_ch_x = {}
+		self.adc_ch_y = {}
+
+		for chan in self.chan_set:
+			self.adc_ch_x[chan] = self.centers
+			self.adc_ch_y[chan] = self.accumulators[chan].mean[self.rows]
 
 	def adc_ch_iterator(self):
 		"""
@@ -297,9 +281,9 @@ class FrequencyResponsePointsV1:
 			header=",".join(["freq_hz"] + cols)
 		)
 
-	def display(self, mode, reference=None):
+	def display(self, mode, reference=None, refresh=None, browse=True):
 		"""
-		Display the frequency response visually
+		Display the frequency response visually, see page.show() for refresh and browse
 
 		Mode.RAW 		Trace adc codes - that is |q(t)| where q is iq, vs f(t) where f is frequency given time
 		Mode.MV			Trace the estimate of signal level in mV rms as a function of frequency
@@ -354,56 +338,81 @@ class FrequencyResponsePointsV1:
 			assert 0
 
 		result = page([spectral])
-		result.show()
+		result.show(refresh=refresh, browse=browse)
 
 parser = argparse.ArgumentParser(description="Produces a plot or a csv file of amplitude frequency response.")
-parser.add_argument("--dut", help="path to a directory containing captures+metadata with test signals fed into device under test", required=True)
-parser.add_argument("--ref", help="path to a directory containing captures+metadata with reference signals (device under test bypassed)")
+parser.add_argument("--dut", help="path to a directory (or a session archive, see mkarchive.py) containing captures+metadata with test signals fed into device under test", required=True)
+parser.add_argument("--ref", help="path to a directory (or a session archive) containing captures+metadata with reference signals (device under test bypassed)")
 parser.add_argument("--trim", help="specify the proportion of pulse head and tail to be discarded in time domain to remove transients, defaults to 0.05")
 parser.add_argument("--offset", help="specify how much extra gain or attenuation of reference signals should be factored in, e.g. 0.00498 or \"-46 dB\"")
 parser.add_argument("--csv", help="write results into a specified csv file")
 parser.add_argument("--model", help="[when no --ref] use an approximate model of reference signals instead of actual reference captures", action="store_true")
 parser.add_argument("--raw", help="[when no --ref] display signal level in |iq| adc codes", action="store_true")
 parser.add_argument("--mv", help="[when no --ref] display signal level in volts", action="store_true")
+parser.add_argument("--bin", help="frequency bin width to pool points into, e.g. \"5 kHz\", defaults to \"10 kHz\"")
+parser.add_argument("--dtype", help="sample type to decode captures into, one of: complex128, complex64, int16; defaults to complex128", choices=["complex128", "complex64", "int16"], default="complex128")
+parser.add_argument("--stream", help="walk the .ISE files once in constant memory instead of indexing the session first, for very long sessions", action="store_true")
+parser.add_argument("--follow", help="keep reading the --dut session while the DDC is still writing it, redrawing (or rewriting --csv) every given number of seconds, e.g. 10; stops once nothing new has arrived for a minute")
+parser.add_argument("--no-cache", help="rebuild model signals from scratch instead of reusing them from ~/.cache/signals", action="store_true")
 args = parser.parse_args()
 
+cache = None if args.no_cache else ArrayCache()
+
 attenuation = float(args.offset or "1.0")
 trim = float(args.trim or "0.05")
+dtype = np.dtype(args.dtype)
+bin_width = parse_freq_expr(args.bin or "10 kHz")
+follow = float(args.follow) if args.follow else None
+
+assert not (args.stream and follow), "--stream and --follow are mutually exclusive"
 
 if args.dut and args.ref:
 	assert not args.model, "--model cannot be used with --ref"
 	assert not args.raw, "--raw cannot be used with --ref"
 	assert not args.mv, "--mv cannot be used with --ref"
 
-	a = FrequencyResponsePointsV1(args.dut, trim=trim)
-	b = FrequencyResponsePointsV1(args.ref, trim=trim, attenuation=attenuation)
+	mode = Mode.REFERENCED
 
-	if args.csv:
-		a.csv(Mode.REFERENCED, args.csv, b)
-	else:
-		a.display(Mode.REFERENCED, b)
+	a = FrequencyResponsePointsV1(args.dut, trim=trim, dtype=dtype, bin_width=bin_width, stream=args.stream, follow=bool(follow), cache=cache)
+	b = FrequencyResponsePointsV1(args.ref, trim=trim, attenuation=attenuation, dtype=dtype, bin_width=bin_width, stream=args.stream, cache=cache)
 elif args.dut:
 	assert (args.model or args.raw or args.mv), "either --raw or --mv or --model must be specified with no --ref"
 	assert not (args.model and args.raw), "--raw and --model are mutually exclusive"
 	assert not (args.model and args.mv), "--mv and --model are mutually exclusive"
 
-	a = FrequencyResponsePointsV1(args.dut, trim=trim, attenuation=attenuation)
+	if args.model:
+		mode = Mode.MODEL
+	elif args.mv:
+		mode = Mode.MV
+	else:
+		mode = Mode.RAW
+
+	a = FrequencyResponsePointsV1(args.dut, trim=trim, attenuation=attenuation, dtype=dtype, bin_width=bin_width, stream=args.stream, follow=bool(follow), cache=cache)
+	b = None
+else:
+	assert 0
 
+def output(refresh=None, browse=True):
 	if args.csv:
-		if args.model:
-			a.csv(Mode.MODEL, args.csv)
-		else:
-			if args.mv:
-				a.csv(Mode.MV, args.csv)
-			else:
-				a.csv(Mode.RAW, args.csv)
+		a.csv(mode, args.csv, b)
 	else:
-		if args.model:
-			a.display(Mode.MODEL)
-		else:
-			if args.mv:
-				a.display(Mode.MV)
-			else:
-				a.display(Mode.RAW)
+		a.display(mode, b, refresh=refresh, browse=browse)
+
+if follow:
+	# Redraw as captures come in, the page reloads itself
+	browse = True
+
+	for batch in follow_batches(args.dut, interval=follow, dtype=dtype):
+		a.fold(batch)
+		a.update()
+
+		print("Followed", a.count, "captures")
+
+		# Nothing to draw until every channel has shown up
+		if not a.chan_set or (b is not None and a.chan_set != b.chan_set):
+			continue
+
+		output(refresh=follow, browse=browse)
+		browse = False
 else:
-	assert 0
+	output()
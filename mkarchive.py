@@ -0,0 +1,13 @@
+import argparse
+
+from src.session import convert_session
+
+parser = argparse.ArgumentParser(description="Converts a directory of captures+metadata into a session archive that opens without parsing.")
+parser.add_argument("--location", help="path to a directory containing captures+metadata", required=True)
+parser.add_argument("--output", help="path to the archive directory to be created", required=True)
+parser.add_argument("--workers", help="number of threads to read the captures with, defaults to one per core")
+args = parser.parse_args()
+
+workers = int(args.workers) if args.workers else None
+
+convert_session(args.location, args.output, workers=workers)
@@ -0,0 +1,39 @@
+import argparse
+import json
+
+from src.misc import parse_time_expr
+from src.synthetic import synthesize_session
+
+parser = argparse.ArgumentParser(description="Synthesizes a directory of captures+metadata from a preset, as if recorded by the DDC. For load testing and regression testing.")
+parser.add_argument("--preset", help="path to a .json preset file, e.g. made by mksweep.py", required=True)
+parser.add_argument("--output", help="path to the session directory to be created", required=True)
+parser.add_argument("--channels", help="channel numbers to capture on, defaults to 1,3")
+parser.add_argument("--repeats", help="how many times every signal gets triggered, defaults to 10")
+parser.add_argument("--files", help="how many .ISE files to spread the captures across, defaults to 1")
+parser.add_argument("--delay", help="trigger delay, e.g. \"500 us\", defaults to \"0 us\"")
+parser.add_argument("--jitter", help="rms trigger delay jitter, e.g. \"200 ns\", defaults to \"0 ns\"")
+parser.add_argument("--noise", help="rms noise per I and Q in ADC codes, defaults to 0")
+parser.add_argument("--phase", help="per-channel phase offsets in degrees matching --channels, e.g. 0,30")
+parser.add_argument("--seed", help="random seed")
+args = parser.parse_args()
+
+with open(args.preset) as f:
+	preset = json.load(f)
+
+channels = [int(x) for x in (args.channels or "1,3").split(",")]
+phases = [float(x) for x in args.phase.split(",")] if args.phase else [0.0]*len(channels)
+
+assert len(phases) == len(channels), "--phase must match --channels"
+
+synthesize_session(
+	args.output,
+	preset,
+	channels=channels,
+	repeats=int(args.repeats or "10"),
+	files=int(args.files or "1"),
+	delay=parse_time_expr(args.delay or "0 us"),
+	jitter=parse_time_expr(args.jitter or "0 ns"),
+	noise=float(args.noise or "0"),
+	phase_offset=dict(zip(channels, phases)),
+	seed=int(args.seed) if args.seed else None
+)
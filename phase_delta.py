@@ -6,14 +6,16 @@ import json
 
 import numpy as np
 
-from src.misc import ad9910_sweep_bandwidth, ad9910_inv_sinc, parse_numeric_expr, parse_time_expr, parse_freq_expr, roll_lerp, ddc_cost_mv
+from src.misc import ad9910_sweep_bandwidth, ad9910_inv_sinc, parse_numeric_expr, parse_time_expr, parse_freq_expr, roll_lerp, ddc_cost_mv, as_complex, BinAccumulator
 from src.delay import SpectralDelayEstimator
 from src.display import minmaxplot, page
-from src.orda import StreamORDA
+from src.session import CaptureSet, stream_session, follow_batches
+from src.cache import ArrayCache
+from src.shots import ShotAssembler
 import src.delay as delay
 import src.dds as dds
 
-from src.workflows.v1 import ModelSignalV1
+from src.workflows import load_models
 from src.schemas.v1 import *
 
 class PhaseDeltaPointsV1:
@@ -41,7 +43,7 @@ class PhaseDeltaPointsV1:
 		- Prepare a model signal
 		- Find associated captures
 		- Establish phase delta across repeated captures
-			- For capture pairs grouped by trigger number
+			- For capture pairs grouped into shots, see src/shots.py
 				- Estimate delay
 				- Eliminate delay
 				- Find phase difference
@@ -56,61 +58,27 @@ class PhaseDeltaPointsV1:
 			- Deals with overlap
 	"""
 
-	def __init__(self, location, idx_a, idx_b, trim=0.05, radians=False):
+	def __init__(self, location, idx_a, idx_b, trim=0.05, radians=False, dtype=np.complex128, stream=False, follow=False, cache=None):
 		with open(f"{location}/preset.json") as f:
 			obj = json.load(f)
 
-		preset = JsonDDCAndCalibratorV1.deserialize(obj["ddc-and-calibrator-v1"])
-
-		captures = []
-
-		# No streaming, just load it all
-		# Will take up some RAM
-		#################################################################################################
-		for filename in sorted(glob(f"{location}/*.ISE")):
-			with open(filename, "rb") as f:
-				for capture in StreamORDA(f).captures:
-					if capture.center_freq == 0:
-						continue # DDC quirk: 0 Hz must be skipped
-
-					captures.append(capture)
-
-		chan_set = set([x.channel_number for x in captures])
-
-		# Trigger number rewrite
-		for i, capture in enumerate(captures):
-			capture.trigger_number = i // len(chan_set)
-
-		print("Loaded", len(captures), "captures")
-		print("Active channels:", chan_set)
-
-		assert idx_a in chan_set, "Channel not available"
-		assert idx_b in chan_set, "Channel not available"
+		# V1 or V2 preset
+		preset, signals = load_models(obj, cache=cache)
 
 		# High density phase delta points
 		fine_delta_x = []
-		fine_delta_y = []
-		fine_delta_upper = []
-		fine_delta_lower = []
 
 		# Low density
 		coarse_delta_x = []
-		coarse_delta_y = []
 
 		model_x = []
 		model_y = []
 
-		signals = []
+		crops = []
 
-		for descriptor in preset.signals:
-			signals.append( ModelSignalV1(descriptor, preset.ddc) )
-
-		# Onto the actual processing
-		# Delay elimination + amplitude + averaging
-		#################################################################################################
-		for i, signal in enumerate(signals):
-			tune = parse_freq_expr(signal.descriptor.tune)
+		tunes = [parse_freq_expr(signal.descriptor.tune) for signal in signals]
 
+		for signal, tune in zip(signals, tunes):
 			# Pulse cropping
 			start = signal.duration*trim
 			stop = signal.duration*(1-trim)
@@ -123,82 +91,137 @@ class PhaseDeltaPointsV1:
 
 			model_x.append(x)
 			model_y.append(y)
+			crops.append(indices)
 
-			# We want 1 vs 3
-			u_filter_fn = lambda x: x.trigger_number % len(signals) == i and x.channel_number == idx_a
-			v_filter_fn = lambda x: x.trigger_number % len(signals) == i and x.channel_number == idx_b
+			fine_delta_x.append(x)
+			coarse_delta_x.append(tune)
 
-			u_repeats = list(filter(u_filter_fn, captures))
-			v_repeats = list(filter(v_filter_fn, captures))
+		# Sort once - this deals with overlap
+		x = np.hstack(fine_delta_x)
+		x, indices = np.sort(x), np.argsort(x)
 
-			assert len(u_repeats) == len(v_repeats)
-			assert all([x.center_freq == tune for x in u_repeats])
-			assert all([x.center_freq == tune for x in v_repeats])
+		self.fine_delta_x = x
+		self.order = indices
+		self.coarse_delta_x = np.hstack(coarse_delta_x)
 
-			# Estimate delay once, for channel a
-			# DO NOT estimate delay individually
-			# Thay would defy the point
-			u_ = []
-			v_ = []
+		self.model_x = np.hstack(model_x)
+		self.model_y = np.hstack(model_y)
 
-			for u, v in zip(u_repeats, v_repeats):
-				delay = signal.est.estimate(u.iq)
+		# Captures of every trigger, one per channel, are grouped into shots
+		# Delay elimination + phase delta + averaging, a group of shots of one signal at a time
+		#
+		# Phase deltas are folded into per-signal, per-sample accumulators;
+		# memory is bounded by signals * frames
+		#################################################################################################
+		frames = preset.ddc.frames
 
-				u_.append( np.roll(u.iq, -delay) )
-				v_.append( np.roll(v.iq, -delay) )
+		self.signals = signals
+		self.crops = crops
+		self.samples = np.arange(frames)
+		self.accumulators = [BinAccumulator(np.arange(frames + 1)) for signal in signals]
+		self.coarse_sums = np.zeros(len(signals))
+		self.assembler = ShotAssembler(tunes)
 
-			u = np.vstack(u_)
-			v = np.vstack(v_)
+		self.idx_a = idx_a
+		self.idx_b = idx_b
 
-			coarse = np.angle( np.sum(u * v.conj(), 1) ).mean(0)
-			deltas = np.angle( u * v.conj() )
+		self.radians = radians
 
-			delta = deltas.mean(0)
-			lower = deltas.min(0)
-			upper = deltas.max(0)
+		# Read the captures a batch at a time
+		#################################################################################################
+		if follow:
+			# Nothing is read here, the caller feeds batches through fold() as they arrive
+			self.update()
+			return
+		elif stream:
+			# Walk the files once
+			batches = stream_session(location, dtype=dtype)
+		else:
+			# Index the captures first, decode in session order
+			captures = CaptureSet(location)
+			batches = captures.batches(dtype=dtype)
 
-			x = signal.temporal_freq[indices] + tune
-			y = delta[indices]
-			upper = upper[indices]
-			lower = lower[indices]
+			print("Loaded", len(captures), "captures")
 
-			fine_delta_x.append(x)
-			fine_delta_y.append(y)
-			fine_delta_upper.append(upper)
-			fine_delta_lower.append(lower)
+		for batch in batches:
+			self.fold(batch)
 
-			coarse_delta_x.append(tune)
-			coarse_delta_y.append(coarse)
+		self.close()
+		self.update()
 
+		print(self.assembler.shot_idx, "shots")
+		print("Active channels:", self.chan_set)
 
-		# Second pass over the data to sort it - this deals with overlap
-		#################################################################################################
-		x = np.hstack(fine_delta_x)
-		y = np.hstack(fine_delta_y)
-		upper = np.hstack(fine_delta_upper)
-		lower = np.hstack(fine_delta_lower)
+		assert idx_a in self.chan_set, "Channel not available"
+		assert idx_b in self.chan_set, "Channel not available"
 
-		x, indices = np.sort(x), np.argsort(x)
-		y = y[indices]
-		upper = upper[indices]
-		lower = lower[indices]
+	def fold(self, batch):
+		"""
+		Fold an ORDABatch in, call update() to see the result
 
-		self.fine_delta_x = x
-		self.fine_delta_y = y
-		self.fine_delta_upper = upper
-		self.fine_delta_lower = lower
+		A shot may span batches, so its last captures may wait for the next one
+		"""
 
-		self.coarse_delta_x = np.hstack(coarse_delta_x)
-		self.coarse_delta_y = np.hstack(coarse_delta_y)
+		for i, shot_idx, iq in self.assembler.group(self.assembler.feed(batch)):
+			self.fold_shots(i, iq)
 
-		self.chan_set = chan_set
-		self.idx_a = idx_a
-		self.idx_b = idx_b
+	def close(self):
+		"""
+		Fold in the last shot, once the session is over
+		"""
 
-		self.radians = radians
+		for i, shot_idx, iq in self.assembler.group(self.assembler.close()):
+			self.fold_shots(i, iq)
 
-		self.model_x = np.hstack(model_x)
-		self.model_y = np.hstack(model_y)
+	def fold_shots(self, i, iq):
+		signal = self.signals[i]
+		channels = self.assembler.channels
+
+		assert self.idx_a in channels, "Channel not available"
+		assert self.idx_b in channels, "Channel not available"
+
+		# We want 1 vs 3
+		# Estimate delay once, for channel a
+		# DO NOT estimate delay individually
+		# Thay would defy the point
+		u = as_complex(iq[:, channels.index(self.idx_a)])
+		v = as_complex(iq[:, channels.index(self.idx_b)])
+
+		delays = signal.est.estimate_batch(u)
+
+		u = signal.corrector.eliminate(u, delays)
+		v = signal.corrector.eliminate(v, delays)
+
+		self.accumulators[i].add(self.samples, np.angle(u * v.conj()), self.samples)
+		self.coarse_sums[i] += np.angle( np.sum(u * v.conj(), 1) ).sum()
+
+	def update(self):
+		"""
+		Turn the accumulators into the phase delta points
+
+		Signals that have no shots yet are nan
+		"""
+
+		# Per signal phase delta across repeated captures:
+		# mean, min, max per sample and coarse
+		fine_delta_y = []
+		fine_delta_upper = []
+		fine_delta_lower = []
+		coarse_delta_y = []
+
+		for acc, coarse, indices in zip(self.accumulators, self.coarse_sums, self.crops):
+			fine_delta_y.append(acc.mean[indices])
+			fine_delta_upper.append(acc.max[indices])
+			fine_delta_lower.append(acc.min[indices])
+			coarse_delta_y.append(coarse / (acc.count[0] or np.nan))
+
+		self.fine_delta_y = np.hstack(fine_delta_y)[self.order]
+		self.fine_delta_upper = np.hstack(fine_delta_upper)[self.order]
+		self.fine_delta_lower = np.hstack(fine_delta_lower)[self.order]
+
+		self.coarse_delta_y = np.hstack(coarse_delta_y)
+
+		self.chan_set = set(self.assembler.channels or [])
 
 	def adc_ch_iterator(self):
 		"""
@@ -247,9 +270,9 @@ class PhaseDeltaPointsV1:
 			header=",".join(cols)
 		)
 
-	def display(self):
+	def display(self, refresh=None, browse=True):
 		"""
-		Display phase delta visually
+		Display phase delta visually, see page.show() for refresh and browse
 		"""
 
 		spectral = minmaxplot("Hz")
@@ -276,23 +299,62 @@ class PhaseDeltaPointsV1:
 		)
 
 		result = page([spectral])
-		result.show()
+		result.show(refresh=refresh, browse=browse)
 
 parser = argparse.ArgumentParser(description="Produces a plot or a csv file of phase difference between two channels, with respect to frequency.")
-parser.add_argument("--location", help="path to a directory containing captures+metadata with test signals fed into device under test", required=True)
+parser.add_argument("--location", help="path to a directory (or a session archive, see mkarchive.py) containing captures+metadata with test signals fed into device under test", required=True)
 parser.add_argument("--channels", help="specify a channel pair pattern a,b to be used when obtaining a phase delta; a will have b subtracted from it", required=True)
 parser.add_argument("--trim", help="specify the proportion of pulse head and tail to be discarded in time domain to remove transients, defaults to 0.05")
 parser.add_argument("--fine", help="[When --csv used] save fine curve instead of coarse, results in a lot more data", action="store_true")
 parser.add_argument("--rad", help="use radians instead of degrees", action="store_true")
 parser.add_argument("--csv", help="write results into a specified csv file")
+parser.add_argument("--dtype", help="sample type to decode captures into, one of: complex128, complex64, int16; defaults to complex128", choices=["complex128", "complex64", "int16"], default="complex128")
+parser.add_argument("--stream", help="walk the .ISE files once in constant memory instead of indexing the session first, for very long sessions", action="store_true")
+parser.add_argument("--follow", help="keep reading the session while the DDC is still writing it, redrawing (or rewriting --csv) every given number of seconds, e.g. 10; stops once nothing new has arrived for a minute")
+parser.add_argument("--no-cache", help="rebuild model signals from scratch instead of reusing them from ~/.cache/signals", action="store_true")
 args = parser.parse_args()
 
+cache = None if args.no_cache else ArrayCache()
+
 trim = float(args.trim or "0.05")
 idx_a, idx_b = [int(x) for x in args.channels.split(",")]
+dtype = np.dtype(args.dtype)
+follow = float(args.follow) if args.follow else None
+
+assert not (args.stream and follow), "--stream and --follow are mutually exclusive"
+
+a = PhaseDeltaPointsV1(args.location, idx_a, idx_b, trim=trim, radians=args.rad, dtype=dtype, stream=args.stream, follow=bool(follow), cache=cache)
+
+def output(refresh=None, browse=True):
+	if args.csv:
+		a.csv(args.csv, args.fine)
+	else:
+		a.display(refresh=refresh, browse=browse)
+
+if follow:
+	# Redraw as captures come in, the page reloads itself
+	browse = True
+
+	for batch in follow_batches(args.location, interval=follow, dtype=dtype):
+		a.fold(batch)
+		a.update()
+
+		print(a.assembler.shot_idx, "shots")
+
+		# Nothing to draw until both channels have shown up
+		if not (idx_a in a.chan_set and idx_b in a.chan_set):
+			continue
+
+		output(refresh=follow, browse=browse)
+		browse = False
+
+	# The session is over, fold in the last shot
+	a.close()
+	a.update()
 
-a = PhaseDeltaPointsV1(args.location, idx_a, idx_b, trim=trim, radians=args.rad)
+	assert idx_a in a.chan_set, "Channel not available"
+	assert idx_b in a.chan_set, "Channel not available"
 
-if args.csv:
-	a.csv(args.csv, args.fine)
+	output(refresh=None, browse=browse)
 else:
-	a.display()
+	output()
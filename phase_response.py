@@ -10,11 +10,13 @@ from src.misc import ad9910_sweep_bandwidth, ad9910_inv_sinc, parse_numeric_expr
 from src.delay import SpectralDelayEstimator
 from src.display import minmaxplot, page
 from src.touchstone import S2PFile
-from src.orda import StreamORDA
+from src.session import CaptureSet, follow_batches
+from src.cache import ArrayCache
+from src.shots import ShotAssembler
 import src.delay as delay
 import src.dds as dds
 
-from src.workflows.v1 import ModelSignalV1
+from src.workflows import load_models
 from src.schemas.v1 import *
 
 class Mode(Enum):
@@ -81,54 +83,23 @@ class PhaseFrequencyResponsePointsV1:
 		arg( z(t) * w(t).conj )
 	"""
 
-	def __init__(self, location, idx_a, idx_b, trim=0.05, radians=False):
+	def __init__(self, location, idx_a, idx_b, trim=0.05, radians=False, follow=False, cache=None):
 		with open(f"{location}/preset.json") as f:
 			obj = json.load(f)
 
-		preset = JsonDDCAndCalibratorV1.deserialize(obj["ddc-and-calibrator-v1"])
-
-		captures = []
-
-		# No streaming, just load it all
-		# Will take up some RAM
-		#################################################################################################
-		for filename in sorted(glob(f"{location}/*.ISE")):
-			with open(filename, "rb") as f:
-				for capture in StreamORDA(f).captures:
-					if capture.center_freq == 0:
-						continue # DDC quirk: 0 Hz must be skipped
-
-					captures.append(capture)
-
-		chan_set = set([x.channel_number for x in captures])
-
-		# Trigger number rewrite
-		for i, capture in enumerate(captures):
-			capture.trigger_number = i // len(chan_set)
-
-		print("Loaded", len(captures), "captures")
-		print("Active channels:", chan_set)
-
-		assert idx_a in chan_set, "Channel not available"
-		assert idx_b in chan_set, "Channel not available"
+		# V1 or V2 preset
+		preset, signals = load_models(obj, cache=cache)
 
 		q_x = []
-		q_y = []
 
 		model_x = []
 		model_y = []
 
-		signals = []
+		crops = []
 
-		for descriptor in preset.signals:
-			signals.append( ModelSignalV1(descriptor, preset.ddc) )
-
-		# Onto the actual processing
-		# Delay elimination + amplitude + averaging
-		#################################################################################################
-		for i, signal in enumerate(signals):
-			tune = parse_freq_expr(signal.descriptor.tune)
+		tunes = [parse_freq_expr(signal.descriptor.tune) for signal in signals]
 
+		for signal, tune in zip(signals, tunes):
 			# Pulse cropping
 			start = signal.duration*trim
 			stop = signal.duration*(1-trim)
@@ -141,56 +112,101 @@ class PhaseFrequencyResponsePointsV1:
 
 			model_x.append(x)
 			model_y.append(y)
+			crops.append(indices)
 
-			u_filter_fn = lambda x: x.trigger_number % len(signals) == i and x.channel_number == idx_a
-			v_filter_fn = lambda x: x.trigger_number % len(signals) == i and x.channel_number == idx_b
+			q_x.append(x)
 
-			u_repeats = list(filter(u_filter_fn, captures))
-			v_repeats = list(filter(v_filter_fn, captures))
+		# Sort once - this deals with overlap
+		x = np.hstack(q_x)
+		x, indices = np.sort(x), np.argsort(x)
 
-			assert len(u_repeats) == len(v_repeats)
-			assert all([x.center_freq == tune for x in u_repeats])
-			assert all([x.center_freq == tune for x in v_repeats])
+		self.q_x = x
+		self.order = indices
 
-			z_n = []
+		self.model_x = np.hstack(model_x)
+		self.model_y = np.hstack(model_y)
 
-			# Estimate delay once, for channel a
-			# DO NOT estimate delay individually
-			# Thay would defy the point
-			for u, v in zip(u_repeats, v_repeats):
-				delay = signal.est.estimate(u.iq)
+		# Captures of every trigger, one per channel, are grouped into shots, see src/shots.py
+		# Delay elimination + averaging, a group of shots of one signal at a time
+		#################################################################################################
+		self.signals = signals
+		self.crops = crops
+		self.z_sums = np.zeros([len(signals), preset.ddc.frames], dtype=np.complex128)
+		self.assembler = ShotAssembler(tunes)
 
-				u_ = np.roll(u.iq, -delay)
-				v_ = np.roll(v.iq, -delay)
+		self.idx_a = idx_a
+		self.idx_b = idx_b
+		self.radians = radians
 
-				z_n.append( u_ * v_.conj() )
+		if follow:
+			# Nothing is read here, the caller feeds batches through fold() as they arrive
+			self.update()
+			return
 
-			z = np.sum(z_n, 0)
+		# Index the captures, decode a batch at a time
+		#################################################################################################
+		captures = CaptureSet(location)
 
-			x = signal.temporal_freq[indices] + tune
-			y = z[indices]
+		print("Loaded", len(captures), "captures")
 
-			q_x.append(x)
-			q_y.append(y)
+		for batch in captures.batches():
+			self.fold(batch)
 
-		# Second pass over the data to sort it - this deals with overlap
-		#################################################################################################
-		x = np.hstack(q_x)
-		y = np.hstack(q_y)
+		self.close()
+		self.update()
 
-		x, indices = np.sort(x), np.argsort(x)
-		y = y[indices]
+		print("Active channels:", self.chan_set)
 
-		self.q_x = x
-		self.q_y = y
-		self.chan_set = chan_set
+		assert idx_a in self.chan_set, "Channel not available"
+		assert idx_b in self.chan_set, "Channel not available"
 
-		self.model_x = np.hstack(model_x)
-		self.model_y = np.hstack(model_y)
+	def fold(self, batch):
+		"""
+		Fold an ORDABatch in, call update() to see the result
 
-		self.idx_a = idx_a
-		self.idx_b = idx_b
-		self.radians = radians
+		A shot may span batches, so its last captures may wait for the next one
+		"""
+
+		for i, shot_idx, iq in self.assembler.group(self.assembler.feed(batch)):
+			self.fold_shots(i, iq)
+
+	def close(self):
+		"""
+		Fold in the last shot, once the session is over
+		"""
+
+		for i, shot_idx, iq in self.assembler.group(self.assembler.close()):
+			self.fold_shots(i, iq)
+
+	def fold_shots(self, i, iq):
+		signal = self.signals[i]
+		channels = self.assembler.channels
+
+		assert self.idx_a in channels, "Channel not available"
+		assert self.idx_b in channels, "Channel not available"
+
+		# Estimate delay once, for channel a
+		# DO NOT estimate delay individually
+		# Thay would defy the point
+		u = iq[:, channels.index(self.idx_a)]
+		v = iq[:, channels.index(self.idx_b)]
+
+		delays = signal.est.estimate_batch(u)
+
+		u = signal.corrector.eliminate(u, delays)
+		v = signal.corrector.eliminate(v, delays)
+
+		self.z_sums[i] += np.sum(u * v.conj(), 0)
+
+	def update(self):
+		"""
+		Turn the sums into the phase response points
+
+		Signals that have no shots yet are 0, i.e. 0 degrees
+		"""
+
+		self.q_y = np.hstack([z[indices] for z, indices in zip(self.z_sums, self.crops)])[self.order]
+		self.chan_set = set(self.assembler.channels or [])
 
 	def csv(self, mode, filename, reference=None):
 		"""
@@ -229,9 +245,9 @@ class PhaseFrequencyResponsePointsV1:
 			header=",".join(cols)
 		)
 
-	def display(self, mode, reference=None):
+	def display(self, mode, reference=None, refresh=None, browse=True):
 		"""
-		Display phase response visually
+		Display phase response visually, see page.show() for refresh and browse
 		"""
 
 		spectral = minmaxplot("Hz")
@@ -253,34 +269,65 @@ class PhaseFrequencyResponsePointsV1:
 			assert 0
 
 		result = page([spectral])
-		result.show()
+		result.show(refresh=refresh, browse=browse)
 
 
 parser = argparse.ArgumentParser(description="Produces a plot or a csv file of phase frequency response, needs special measurement setup.")
-parser.add_argument("--dut", help="path to a directory containing captures+metadata with test signals split into bypass + fed into device under test", required=True)
-parser.add_argument("--ref", help="path to a directory containing captures+metadata with test signals split into bypass + fed into a thru")
+parser.add_argument("--dut", help="path to a directory (or a session archive, see mkarchive.py) containing captures+metadata with test signals split into bypass + fed into device under test", required=True)
+parser.add_argument("--ref", help="path to a directory (or a session archive) containing captures+metadata with test signals split into bypass + fed into a thru")
 parser.add_argument("--channels", help="specify a channel pair pattern a,b where a is a bypass channel and b is either a thru or a dut channel", required=True)
 parser.add_argument("--trim", help="specify the proportion of pulse head and tail to be discarded in time domain to remove transients, defaults to 0.05")
 parser.add_argument("--rad", help="use radians instead of degrees", action="store_true")
 parser.add_argument("--csv", help="write results into a specified csv file")
+parser.add_argument("--follow", help="keep reading the --dut session while the DDC is still writing it, redrawing (or rewriting --csv) every given number of seconds, e.g. 10; stops once nothing new has arrived for a minute")
+parser.add_argument("--no-cache", help="rebuild model signals from scratch instead of reusing them from ~/.cache/signals", action="store_true")
 args = parser.parse_args()
 
+cache = None if args.no_cache else ArrayCache()
+
 trim = float(args.trim or "0.05")
 idx_a, idx_b = [int(x) for x in args.channels.split(",")]
+follow = float(args.follow) if args.follow else None
+
+a = PhaseFrequencyResponsePointsV1(args.dut, idx_a, idx_b, trim=trim, radians=args.rad, follow=bool(follow), cache=cache)
 
 if args.ref:
-	a = PhaseFrequencyResponsePointsV1(args.dut, idx_a, idx_b, trim=trim, radians=args.rad)
-	b = PhaseFrequencyResponsePointsV1(args.ref, idx_a, idx_b, trim=trim, radians=args.rad)
+	mode = Mode.REFERENCED
+	b = PhaseFrequencyResponsePointsV1(args.ref, idx_a, idx_b, trim=trim, radians=args.rad, cache=cache)
+else:
+	mode = Mode.NO_REFERENCE
+	b = None
 
+def output(refresh=None, browse=True):
 	if args.csv:
-		a.csv(Mode.REFERENCED, args.csv, b)
+		a.csv(mode, args.csv, b)
 	else:
-		a.display(Mode.REFERENCED, b)
+		a.display(mode, b, refresh=refresh, browse=browse)
 
-else:
-	a = PhaseFrequencyResponsePointsV1(args.dut, idx_a, idx_b, trim=trim, radians=args.rad)
+if follow:
+	# Redraw as captures come in, the page reloads itself
+	browse = True
 
-	if args.csv:
-		a.csv(Mode.NO_REFERENCE, args.csv)
-	else:
-		a.display(Mode.NO_REFERENCE)
+	for batch in follow_batches(args.dut, interval=follow):
+		a.fold(batch)
+		a.update()
+
+		print(a.assembler.shot_idx, "shots")
+
+		# Nothing to draw until both channels have shown up
+		if not (idx_a in a.chan_set and idx_b in a.chan_set):
+			continue
+
+		output(refresh=follow, browse=browse)
+		browse = False
+
+	# The session is over, fold in the last shot
+	a.close()
+	a.update()
+
+	assert idx_a in a.chan_set, "Channel not available"
+	assert idx_b in a.chan_set, "Channel not available"
+
+	output(refresh=None, browse=browse)
+else:
+	output()
@@ -0,0 +1,162 @@
+import hashlib
+import shutil
+import json
+import os
+
+import numpy as np
+
+#
+# Persistent on-disk cache of arrays
+#
+# Entries are directories of .npy files, named after a sha256 of:
+# - Whatever the arrays were made from, e.g. a signal descriptor and DDC settings
+# - The library version, a digest of the sources that make the arrays,
+#   so changing the modelling code invalidates old entries by itself
+#
+# Entries are memory-mapped on reuse
+# Once the cache grows past its size bound, least recently used entries are evicted
+#
+
+# Sources the cached arrays depend on, relative to src/
+SOURCES = ["dds.py", "delay.py", "misc.py", "workflows/v1/modelling.py"]
+
+def library_version():
+	"""
+	Digest of the sources the cached arrays depend on
+	"""
+
+	digest = hashlib.sha256()
+	root = os.path.dirname(os.path.abspath(__file__))
+
+	for name in SOURCES:
+		with open(os.path.join(root, name), "rb") as f:
+			digest.update(f.read())
+
+	return digest.hexdigest()
+
+def default_location():
+	return os.path.join(os.path.expanduser("~"), ".cache", "signals")
+
+class ArrayCache:
+	"""
+	Content-addressed cache of named arrays
+
+	location	directory to keep the entries in, created on demand
+	max_bytes	size bound, least recently used entries are evicted past it
+
+	Failing to write is not an error - the cache is just skipped
+
+	Example:
+
+	```
+	cache = ArrayCache()
+	key = cache.key("ModelSweepV1", ddc.samplerate, ddc.frames)
+	arrays = cache.load(key)
+
+	if arrays is None:
+		arrays = { "iq": make_iq() }
+		cache.store(key, arrays)
+	```
+	"""
+
+	def __init__(self, location=None, max_bytes=512*1024*1024):
+		self.location = location or default_location()
+		self.max_bytes = max_bytes
+		self.version = library_version()
+		self.size = None
+
+	def key(self, *parts):
+		"""
+		Hex digest of the parts, which must be json serializable
+		"""
+
+		text = json.dumps([self.version] + list(parts))
+
+		return hashlib.sha256(text.encode()).hexdigest()
+
+	def load(self, key):
+		"""
+		Dict of memory-mapped read-only arrays, or None if not cached
+		"""
+
+		path = os.path.join(self.location, key)
+
+		try:
+			names = os.listdir(path)
+			arrays = { name[:-4]: np.load(os.path.join(path, name), mmap_mode="r") for name in names }
+
+			# Recently used
+			os.utime(path)
+		except (OSError, ValueError):
+			return None
+
+		return arrays
+
+	def store(self, key, arrays):
+		"""
+		Write a dict of arrays under a key
+
+		Entries are written to a temporary directory first, then renamed into place,
+		so concurrent readers never see half of one
+		"""
+
+		path = os.path.join(self.location, key)
+		tmp = f"{path}.tmp{os.getpid()}"
+
+		try:
+			os.makedirs(tmp, exist_ok=True)
+
+			for name, array in arrays.items():
+				np.save(os.path.join(tmp, f"{name}.npy"), np.asarray(array))
+
+			size = self.entry_size(tmp)
+			os.replace(tmp, path)
+		except OSError:
+			shutil.rmtree(tmp, ignore_errors=True)
+			return
+
+		if self.size is None:
+			self.size = sum([size for mtime, size, path in self.entries()])
+		else:
+			self.size += size
+
+		if self.size > self.max_bytes:
+			self.evict()
+
+	def entry_size(self, path):
+		return sum([os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)])
+
+	def entries(self):
+		"""
+		(mtime, size, path) of every entry, oldest first
+		"""
+
+		result = []
+
+		for name in os.listdir(self.location):
+			path = os.path.join(self.location, name)
+
+			if ".tmp" in name or not os.path.isdir(path):
+				continue
+
+			try:
+				result.append( (os.path.getmtime(path), self.entry_size(path), path) )
+			except OSError:
+				continue # Evicted by someone else meanwhile
+
+		return sorted(result)
+
+	def evict(self):
+		"""
+		Remove least recently used entries until the cache fits its size bound
+		"""
+
+		entries = self.entries()
+		self.size = sum([size for mtime, size, path in entries])
+
+		for mtime, size, path in entries:
+			if self.size <= self.max_bytes:
+				break
+
+			shutil.rmtree(path, ignore_errors=True)
+			self.size -= size
@@ -87,17 +87,37 @@ def psk(time, freq, code = [0, 0, 1, 0, 1]):
 	assert samples % elements == 0
 
 	element_duration = samples // elements
-	code_mask = []
+	code_mask = np.repeat(np.asarray(code), element_duration)
 
-	for element in code:
-	    code_mask += [element]*element_duration
+	phase_offset = code_mask * np.pi
 
-	phase_offset = np.array(code_mask) * np.pi
+	return np.exp(1j * (freq*2*np.pi*time + phase_offset))
 
-	real = np.cos(freq*2*np.pi*time + phase_offset)
-	imag = np.sin(freq*2*np.pi*time + phase_offset)
+def psk_batch(time, freq, codes):
+	"""
+	Produces many PSK codes at once, e.g. for code search
+
+	time			time series tensor
+	freq			carrier frequency in Hz
+	codes			(n, elements) code words, same length
+
+	Returns (n, samples), row i being psk(time, freq, codes[i])
+
+	The carrier is computed once; every code word only rotates it
+	"""
 
-	return real + 1j*imag
+	codes = np.atleast_2d(codes)
+	samples = time.shape[0]
+	elements = codes.shape[1]
+
+	assert samples % elements == 0
+
+	element_duration = samples // elements
+
+	carrier = np.exp(1j * freq*2*np.pi*time)
+	rotators = np.exp(1j * codes * np.pi)
+
+	return np.repeat(rotators, element_duration, axis=1) * carrier
 
 def rotator(phase_offset):
 	"""
@@ -106,3 +126,79 @@ def rotator(phase_offset):
 	phase offset	phase in degrees
 	"""
 	return np.e**( (phase_offset/180.0*np.pi) * 1j )
+
+#
+# AD9910 phase accumulator model
+#
+# The AD9910 adds a 32-bit FTW to a 32-bit phase accumulator every sysclk cycle,
+# adds the 16-bit POW to its upper 16 bits and looks the result up in a sine table
+#
+# The digital ramp generator adds `a` to the FTW every 4*b sysclk cycles (see ad9910_sweep_bandwidth)
+#
+# Everything is integer arithmetic with wraparound, so the output is exact however long the capture;
+# compare with sine()/sweep(), which accumulate float64 rounding in phase over long time series
+#
+
+AD9910_LUT = np.exp(2j*np.pi*np.arange(2**16) / 2**16)
+
+def ad9910_accumulator(cycles, ftw, a=0, b=1):
+	"""
+	AD9910 phase accumulator state at the given sysclk cycles
+
+	cycles		integer array of sysclk cycle numbers, 0 being the accumulator reset
+	ftw		frequency tuning word at cycle 0
+	a, b		digital ramp step and step interval, a=0 for a single tone
+
+	Returns uint32 accumulator values
+
+	The ramp makes the FTW at cycle m:
+
+		FTW(m) = ftw + a*floor(m/P),	P = 4*b
+
+	And the accumulator at cycle n is the sum of FTW(m) for m < n, in closed form with n = q*P + r:
+
+		acc(n) = n*ftw + a*(P*q*(q-1)/2 + q*r)	mod 2**32
+
+	uint64 wraps mod 2**64, which preserves the result mod 2**32,
+	so any cycle can be evaluated on its own without a cumulative sum
+
+	The ramp's upper limit is not modelled - keep the cycles within the sweep duration
+	"""
+
+	n = np.asarray(cycles, dtype=np.uint64)
+	P = np.uint64(4*b)
+
+	q = n // P
+	r = n % P
+
+	# q*(q-1) is even; halve whichever factor is, before the product gets wrapped
+	one = np.uint64(1)
+	two = np.uint64(2)
+	triangle = np.where(q % two == 0, (q // two) * (q - one), q * ((q - one) // two))
+
+	steps = P * triangle + q * r
+
+	acc = n * np.uint64(ftw) + np.uint64(a) * steps
+
+	return (acc & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+def ad9910_nco(time, ftw, pow=0, a=0, b=1, sysclk=1000*1000*1000):
+	"""
+	Produces the AD9910 output sequence, bit-exact in phase
+
+	time			time series tensor, sampled on sysclk cycles
+	ftw			frequency tuning word, f = ftw * sysclk / 2**32
+	pow			phase offset word, phase = pow / 2**16 * 360 deg
+	a, b			digital ramp, see ad9910_accumulator()
+	sysclk			DDS clock in Hz
+
+	Phase to amplitude conversion is an ideal 2**16-entry complex sine table;
+	DAC quantization is not modelled
+	"""
+
+	cycles = np.round(np.asarray(time) * sysclk).astype(np.uint64)
+	acc = ad9910_accumulator(cycles, ftw, a, b)
+
+	index = ((acc >> np.uint32(16)) + np.uint32(pow)) & np.uint32(0xFFFF)
+
+	return AD9910_LUT[index]
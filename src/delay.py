@@ -1,23 +1,86 @@
 import numpy as np
 
-def delay_in_freq(n, samples):
+from .misc import as_complex
+
+def delay_in_freq(n, samples, signed=False):
 	"""
 	Time delay in frequency domain helper
 
 	n				delay in samples
 	samples			total number of samples
+	signed			use signed bin numbers, in np.fft.fft order;
+					required for fractional n, identical otherwise
+
+	Multiplying a spectrum by it advances the signal by n, i.e. np.roll(x, -n)
+	"""
+
+	k = np.fft.fftfreq(samples, 1 / samples) if signed else np.arange(samples)
+
+	return np.exp(1j * k * 2 * np.pi * n / samples)
+
+class DelayCorrector():
+	"""
+	Removes fractional-sample delays from a stack of captures in frequency domain
+
+	Delays are snapped to a grid of `resolution` samples
+	Twiddle vectors are cached per grid point, as repeat groups tend to share delays
+
+	Parameters:
+	frames			capture length
+	resolution		delay grid step in samples
+	cache_size		how many twiddle vectors to keep
 	"""
 
-	return np.exp(1j * np.arange(samples) * 2 * np.pi * n / samples)
+	def __init__(self, frames, resolution=1/64, cache_size=256):
+		self.frames = frames
+		self.resolution = resolution
+		self.cache_size = cache_size
+		self.twiddles = {}
+
+	def twiddle(self, step):
+		if step not in self.twiddles:
+			if len(self.twiddles) >= self.cache_size:
+				del self.twiddles[ next(iter(self.twiddles)) ]
+
+			self.twiddles[step] = delay_in_freq(step * self.resolution, self.frames, signed=True)
+
+		return self.twiddles[step]
+
+	def eliminate(self, signals, delays):
+		"""
+		Align captures to the model
+
+		signals		(n, frames) captures
+		delays		(n,) delays in samples, as given by the estimators
+
+		Returns (n, frames) complex captures with the delays removed
+		"""
+
+		signals = as_complex(signals)
+
+		if len(signals) == 0:
+			return signals
+
+		steps = np.round( np.asarray(delays) / self.resolution ).astype(np.int64)
+		unique, inverse = np.unique(steps, return_inverse=True)
+
+		twiddles = np.vstack([self.twiddle(int(x)) for x in unique])
+		spectrum = np.fft.fft(signals, axis=1)
+		spectrum *= twiddles[inverse.ravel()]
+
+		return np.fft.ifft(spectrum, axis=1)
 
 class ConvDelayEstimator():
 	"""
 	A general purpose delay estimator for any kind of signal
 
 	Steps:
-	- Performing a convolution using FFT
-	- Fitting a curve using least squares method
-	- Finding the peak of the curve
+	- Performing a cross-correlation using FFT
+	- Finding the peak of the correlation magnitude
+	- Fitting a parabola through the peak and its two neighbours
+	- Finding the vertex of the parabola
+
+	Delays are in samples, wrapped into [-frames/2, frames/2) like SpectralDelayEstimator's
 
 	Parameters:
 	model_signal		iq of reference signal with no delay
@@ -25,28 +88,40 @@ class ConvDelayEstimator():
 
 	def __init__(self, model_signal):
 		self.spectrum_m = np.fft.fft(np.roll(np.flip(model_signal), 1).conj())
-		self.n = 6
+		self.frames = model_signal.shape[0]
 
 	def estimate(self, signal):
-		spectrum_s = np.fft.fft(signal)
+		return self.estimate_batch( as_complex(signal)[None] )[0]
+
+	def estimate_batch(self, signals):
+		"""
+		Estimate over a stack of captures at once
+
+		signals		(n, frames) captures
+
+		Returns (n,) delays
+		"""
+
+		spectrum_s = np.fft.fft(as_complex(signals), axis=1)
 		spectrum_c = spectrum_s * self.spectrum_m
-		convolved = np.fft.ifft(spectrum_c)
-		score = np.abs(convolved)
-
-		values, indices = np.sort(score), np.argsort(score)
-		values = values[-self.n:]
-		indices = indices[-self.n:]
-		matrix = np.vstack([ indices, indices*indices, np.ones(self.n) ]).double().T
-		solution, _, _, _ = np.linalg.lstsq(matrix, values)
-		a, b, c = solution
-
-		# ax + bx^2 + c = ...
-		# a + 2bx = 0
-		# 2bx = -a
-		# x = -a/(2b)
-		sample_delay = -a / 2 / b
+		score = np.abs( np.fft.ifft(spectrum_c, axis=1) )
 
-		return sample_delay
+		rows = np.arange(score.shape[0])
+		peak = np.argmax(score, axis=1)
+
+		# Correlation is circular, so are the neighbours
+		y0 = score[rows, (peak - 1) % self.frames]
+		y1 = score[rows, peak]
+		y2 = score[rows, (peak + 1) % self.frames]
+
+		# Vertex of a parabola through (-1, y0), (0, y1), (1, y2)
+		curvature = y0 - 2*y1 + y2
+		safe = np.where(curvature == 0, 1, curvature)
+		offset = np.where(curvature == 0, 0, 0.5 * (y0 - y2) / safe)
+
+		sample_delay = peak + offset
+
+		return (sample_delay + self.frames/2) % self.frames - self.frames/2
 
 class SpectralDelayEstimator():
 	"""
@@ -58,10 +133,72 @@ class SpectralDelayEstimator():
 	indices_allow		indices of non-marginal spectral content
 	"""
 
+	# Captures per estimate_batch() pass, i.e. work buffer rows
+	chunk = 256
+
 	def __init__(self, model_signal, indices_allow):
 		self.spectrum_m = np.fft.fft(np.roll(np.flip(model_signal), 1).conj())
 		self.frames = model_signal.shape[0]
 		self.indices_allow = indices_allow
+		self.prepare()
+
+	@classmethod
+	def from_spectrum(cls, spectrum_m, indices_allow):
+		"""
+		Rebuild an estimator from a spectrum_m saved earlier, e.g. by src/cache.py
+		"""
+
+		self = cls.__new__(cls)
+		self.spectrum_m = spectrum_m
+		self.frames = spectrum_m.shape[0]
+		self.indices_allow = indices_allow
+		self.prepare()
+
+		return self
+
+	def prepare(self):
+		"""
+		Precompute the constant side of V2
+
+		V2 computes, per capture:
+			shifted = fftshift(S * M)
+			sum( shifted[k] * shifted[k-1].conj() ) over allowed k
+
+		fftshift and roll are permutations, so the same sum is:
+			sum( S[a] * S[b].conj() * M[a] * M[b].conj() )
+
+		Where a, b are the unshifted positions of k, k-1
+		The gathers and the M product are constant - only the FFT of S remains per capture
+
+		The FFT and the gathers write into work buffers kept by the estimator,
+		so it must not be shared between threads; stacks are walked in chunks
+		of self.chunk captures, which bounds the buffers whatever the stack size
+		"""
+
+		perm = np.fft.fftshift( np.arange(self.frames) )
+		allowed = np.arange(self.frames)[self.indices_allow]
+
+		self.a = perm[allowed]
+		self.b = perm[(allowed - 1) % self.frames]
+		self.weights = self.spectrum_m[self.a] * self.spectrum_m[self.b].conj()
+		self.buffers = {}
+
+	def work(self, n, dtype):
+		"""
+		Work buffers for n <= self.chunk captures: spectrum, gather at a, gather at b
+
+		Kept per complex sample type, so complex64 input stays complex64;
+		the sum over bins is still taken against complex128 weights, in double precision
+		"""
+
+		if dtype not in self.buffers:
+			self.buffers[dtype] = (
+				np.empty([self.chunk, self.frames], dtype=dtype),
+				np.empty([self.chunk, len(self.a)], dtype=dtype),
+				np.empty([self.chunk, len(self.b)], dtype=dtype)
+			)
+
+		return [x[:n] for x in self.buffers[dtype]]
 
 	# V0: initial version
 	def estimate_old_old(self, signal):
@@ -102,8 +239,8 @@ class SpectralDelayEstimator():
 		return sample_delay
 
 	# V2: avoid excessive use np.angle() which is expensive
-	def estimate(self, signal):
-		spectrum_s = np.fft.fft(signal)
+	def estimate_old_v2(self, signal):
+		spectrum_s = np.fft.fft(as_complex(signal))
 		spectrum_c = spectrum_s * self.spectrum_m
 
 		shifted = np.fft.fftshift(spectrum_c)
@@ -112,3 +249,45 @@ class SpectralDelayEstimator():
 		tau = np.angle(acc_angle) * self.frames / (2*np.pi)
 
 		return -tau
+
+	# V3: V2 with the shift, roll and model spectrum folded into constants, see prepare()
+	def estimate(self, signal):
+		signal = as_complex(signal)
+		spectrum_s, gather_a, gather_b = [x[0] for x in self.work(1, signal.dtype)]
+
+		np.fft.fft(signal, out=spectrum_s)
+		np.take(spectrum_s, self.a, out=gather_a)
+		np.take(spectrum_s, self.b, out=gather_b)
+		np.conjugate(gather_b, out=gather_b)
+
+		acc_angle = np.einsum("i,i,i->", gather_a, gather_b, self.weights)
+		tau = np.angle(acc_angle) * self.frames / (2*np.pi)
+
+		return -tau
+
+	def estimate_batch(self, signals):
+		"""
+		V3 over a stack of captures at once
+
+		signals		(n, frames) captures
+
+		Returns (n,) delays
+		"""
+
+		acc_angle = np.empty(len(signals), dtype=np.complex128)
+
+		for start in range(0, len(signals), self.chunk):
+			# int16 is widened a chunk at a time too
+			chunk = as_complex(signals[start:start + self.chunk])
+			spectrum_s, gather_a, gather_b = self.work(len(chunk), chunk.dtype)
+
+			np.fft.fft(chunk, axis=1, out=spectrum_s)
+			np.take(spectrum_s, self.a, axis=1, out=gather_a)
+			np.take(spectrum_s, self.b, axis=1, out=gather_b)
+			np.conjugate(gather_b, out=gather_b)
+
+			acc_angle[start:start + len(chunk)] = np.einsum("ij,ij,j->i", gather_a, gather_b, self.weights)
+
+		tau = np.angle(acc_angle) * self.frames / (2*np.pi)
+
+		return -tau
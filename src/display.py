@@ -272,9 +272,21 @@ class page():
 		for fig in figs:
 			self.write_fig(file, fig)
 
-	def show(self):
+	def show(self, refresh=None, browse=True):
+		"""
+		Write result.html and open it in a browser
+
+		refresh		have the browser reload the page every given number of seconds,
+				for pages rewritten as data keeps coming in
+		browse		False to only rewrite the page, e.g. when it is already open
+		"""
+
 		with open("result.html", "w", encoding="utf8") as file:
 			file.write("<!DOCTYPE html>")
+
+			if refresh:
+				file.write(f"<meta http-equiv=\"refresh\" content=\"{refresh:g}\">")
+
 			file.write(style)
 			file.write("<main>")
 
@@ -289,7 +301,8 @@ class page():
 
 			file.write("</main>")
 
-		webbrowser.open("result.html")
+		if browse:
+			webbrowser.open("result.html")
 
 def waveform(time, signal, title=None, error_band=None):
 	"""
@@ -14,7 +14,7 @@ from src.orda import StreamORDA
 import src.delay as delay
 import src.dds as dds
 
-from src.workflows.v1 import ModelSignalV1
+from src.workflows.v1 import ModelSignalFactoryV1
 from src.schemas.v1 import *
 
 """
@@ -196,8 +196,10 @@ def run_v1():
 
 	signals = []
 
+	factory = ModelSignalFactoryV1(preset.ddc)
+
 	for descriptor in preset.signals:
-		signals.append( ModelSignalV1(descriptor, preset.ddc) )
+		signals.append( factory(descriptor) )
 
 	bins = np.linspace(153.5*1000*1000, 162.5*1000*1000, 1024)
 
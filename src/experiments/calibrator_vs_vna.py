@@ -13,7 +13,7 @@ from src.orda import StreamORDA
 import src.delay as delay
 import src.dds as dds
 
-from src.workflows.v1 import ModelSignalV1
+from src.workflows.v1 import ModelSignalFactoryV1
 from src.schemas.v1 import *
 
 def run_v3():
@@ -116,8 +116,10 @@ def run_v3():
 
 			signals = []
 
+			factory = ModelSignalFactoryV1(preset.ddc)
+
 			for descriptor in preset.signals:
-				signals.append( ModelSignalV1(descriptor, preset.ddc) )
+				signals.append( factory(descriptor) )
 
 			# Onto the actual processing
 			# Delay elimination + amplitude + averaging
@@ -321,8 +323,10 @@ def run_v2():
 
 			signals = []
 
+			factory = ModelSignalFactoryV1(preset.ddc)
+
 			for descriptor in preset.signals:
-				signals.append( ModelSignalV1(descriptor, preset.ddc) )
+				signals.append( factory(descriptor) )
 
 			# Onto the actual processing
 			# Delay elimination + amplitude + averaging
@@ -10,11 +10,11 @@ from src.misc import ad9910_sweep_bandwidth, ad9910_inv_sinc, parse_numeric_expr
 from src.delay import SpectralDelayEstimator
 from src.display import minmaxplot, page
 from src.touchstone import S2PFile
-from src.orda import StreamORDA
+from src.session import CaptureSet
 import src.delay as delay
 import src.dds as dds
 
-from src.workflows.v1 import ModelSignalV1
+from src.workflows.v1 import ModelSignalFactoryV1
 from src.schemas.v1 import *
 
 """
@@ -125,30 +125,21 @@ def extract_phase_delta(captures, signals):
 		stop = signal.duration*(1-trim)
 
 		# We want 1 vs 3
-		u_filter_fn = lambda x: x.center_freq == tune and x.channel_number == idx_a
-		v_filter_fn = lambda x: x.center_freq == tune and x.channel_number == idx_b
-
-		u_repeats = list(filter(u_filter_fn, captures))
-		v_repeats = list(filter(v_filter_fn, captures))
+		u_repeats = captures.select(channel=idx_a, center_freq=tune)
+		v_repeats = captures.select(channel=idx_b, center_freq=tune)
 
 		assert len(u_repeats) == len(v_repeats)
-		assert all([x.center_freq == tune for x in u_repeats])
-		assert all([x.center_freq == tune for x in v_repeats])
 
 		# Estimate delay once, for channel a
 		# DO NOT estimate delay individually
 		# Thay would defy the point
-		u_ = []
-		v_ = []
-
-		for u, v in zip(u_repeats, v_repeats):
-			delay = signal.est.estimate(u.iq)
+		u = u_repeats.iq()
+		v = v_repeats.iq()
 
-			u_.append( np.roll(u.iq, -delay) )
-			v_.append( np.roll(v.iq, -delay) )
+		delays = signal.est.estimate_batch(u)
 
-		u = np.vstack(u_)
-		v = np.vstack(v_)
+		u = signal.corrector.eliminate(u, delays)
+		v = signal.corrector.eliminate(v, delays)
 
 		coarse = np.angle( np.sum(u * v.conj(), 1) ).mean(0)
 
@@ -178,43 +169,33 @@ def run_v1():
 
 	fig, (ax1, ax2) = plt.subplots(2)
 
+	factory = ModelSignalFactoryV1(preset.ddc)
+
 	for descriptor in preset.signals:
-		signals.append( ModelSignalV1(descriptor, preset.ddc) )
+		signals.append( factory(descriptor) )
 
 	for session in sessions:
-		fwd_captures = []
-		inv_captures = []
-
-		for filename in sorted(glob(capdir + session["forward"] + "/*.ISE")):
-			with open(filename, "rb") as f:
-				for capture in StreamORDA(f).captures:
-					fwd_captures.append(capture)
+		# Files are indexed in parallel, nothing is decoded until a query
+		fwd_captures = CaptureSet(capdir + session["forward"])
+		inv_captures = CaptureSet(capdir + session["inverse"])
 
-				print(filename)
-
-		for filename in sorted(glob(capdir + session["inverse"] + "/*.ISE")):
-			with open(filename, "rb") as f:
-				for capture in StreamORDA(f).captures:
-					inv_captures.append(capture)
-
-				print(filename)
+		print(fwd_captures.filenames)
+		print(inv_captures.filenames)
 
 		if session["forward"] < session["inverse"]:
 			print("Forward first")
-			since = fwd_captures[-1].timestamp - timedelta(minutes=5)
-			until = inv_captures[0].timestamp + timedelta(minutes=5)
+			since = fwd_captures.timestamp[-1].astype(datetime) - timedelta(minutes=5)
+			until = inv_captures.timestamp[0].astype(datetime) + timedelta(minutes=5)
 		else:
-			since = inv_captures[-1].timestamp - timedelta(minutes=5)
-			until = fwd_captures[0].timestamp + timedelta(minutes=5)
+			since = inv_captures.timestamp[-1].astype(datetime) - timedelta(minutes=5)
+			until = fwd_captures.timestamp[0].astype(datetime) + timedelta(minutes=5)
 			print("Inverse first")
 
 		print(since)
 		print(until)
 
-		filter_fn = lambda x: (x.timestamp >= since) and (x.timestamp < until)
-
-		fwd_captures = list(filter(filter_fn, fwd_captures))
-		inv_captures = list(filter(filter_fn, inv_captures))
+		fwd_captures = fwd_captures.select(since=since, until=until)
+		inv_captures = inv_captures.select(since=since, until=until)
 
 		print(len(fwd_captures), "forward captures")
 		print(len(inv_captures), "inverse captures")
@@ -16,6 +16,117 @@ def downsample(x, y, roundto=0.1):
 
 	return unique, np.split(y, indices[1:])
 
+class BinAccumulator:
+	"""
+	Running sum, min, max and count of values per bin
+
+	Bin i holds x in [edges[i], edges[i+1]); x outside the edges is ignored
+
+	Values are folded in one batch at a time and never kept,
+	so memory stays O(bins) however many captures go through
+	"""
+
+	def __init__(self, edges):
+		self.edges = np.asarray(edges)
+
+		bins = len(self.edges) - 1
+
+		self.sum = np.zeros(bins)
+		self.count = np.zeros(bins, dtype=np.int64)
+		self.min = np.full(bins, np.inf)
+		self.max = np.full(bins, -np.inf)
+
+	def digitize(self, x):
+		"""
+		Bin numbers of x, -1 or len(self) for out of range
+		"""
+
+		return np.digitize(x, self.edges) - 1
+
+	def __len__(self):
+		return len(self.sum)
+
+	def add(self, x, y, bins=None):
+		"""
+		Fold values in
+
+		x	(w,) positions
+		y	(w,) or (h, w) values, rows sharing positions, e.g. repeated captures
+		bins	digitize(x), to skip recomputing it for every batch at the same x
+		"""
+
+		y = np.atleast_2d(y)
+
+		if y.shape[0] == 0:
+			return
+
+		bins = self.digitize(x) if bins is None else bins
+		valid = (bins >= 0) & (bins < len(self))
+
+		bins = bins[valid]
+		y = y[:, valid]
+
+		self.sum += np.bincount(bins, weights=y.sum(0), minlength=len(self))
+		self.count += np.bincount(bins, minlength=len(self)) * y.shape[0]
+
+		np.minimum.at(self.min, bins, y.min(0))
+		np.maximum.at(self.max, bins, y.max(0))
+
+	@property
+	def mean(self):
+		"""
+		Mean per bin, nan for empty bins
+		"""
+
+		with np.errstate(invalid="ignore"):
+			return self.sum / self.count
+
+def frequency_bins(x, width):
+	"""
+	Bin grid to pool points at frequencies x into, see BinAccumulator
+
+	Returns (edges, rows, centers):
+	edges		bin edges
+	rows		numbers of the bins that make up the response
+	centers		center frequencies of those bins
+
+	A sweep's frequencies, rounded to `width`, form a contiguous grid;
+	its points are the edges and every bin in between is part of the response
+	(points rounded onto the last edge fall outside and are dropped)
+
+	Sparse models such as v2 chip sequences leave gaps in that grid, so they get
+	a `width` wide bin centered on every distinct rounded frequency instead;
+	the bins spanning the gaps are left out of the response
+	"""
+
+	grid = np.unique( np.round(np.asarray(x)/width)*width )
+
+	if len(grid) > 1 and np.all(np.diff(grid) < 1.5*width):
+		return grid, np.arange(len(grid) - 1), grid[1:] - width/2
+
+	edges = np.unique( np.concatenate([grid - width/2, grid + width/2]) )
+	rows = np.searchsorted(edges, grid - width/2)
+
+	return edges, rows, grid
+
+def as_complex(iq):
+	"""
+	Accept I/Q in any of the capture sample types
+
+	Complex arrays are passed through as is
+	int16 (..., 2) real, imag pairs become complex64, which is exact for them
+	"""
+
+	if np.iscomplexobj(iq):
+		return iq
+
+	assert iq.shape[-1] == 2, "Expected (..., 2) real, imag pairs"
+
+	result = np.empty(iq.shape[:-1], dtype=np.complex64)
+	result.real = iq[..., 0]
+	result.imag = iq[..., 1]
+
+	return result
 
 #
 # AD9910 sweep calculations
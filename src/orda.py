@@ -1,6 +1,9 @@
 
 from datetime import datetime, timedelta, timezone
 import struct
+import mmap
+import time
+import os
 
 import numpy as np
 
@@ -8,6 +11,51 @@ import numpy as np
 # Loader for the bespoke ORDA .ISE/.SPU format used at Irkutsk Incoherent Scatter Radar
 #
 
+# Block index record, one per I/Q block
+# Offset points at the payload, not at the block header
+ORDA_INDEX_DTYPE = np.dtype([
+	("offset", "<u8"),
+	("channel", "u1"),
+	("center_freq", "<i8"),
+	("samplerate", "<i8"),
+	("samplecount", "<u4"),
+	("timestamp", "<M8[us]"),
+	("trigger", "<u8")
+])
+
+def decode_iq(raw, dtype=np.complex128, out=None):
+	"""
+	Convert raw ORDA samples into the requested sample type
+
+	raw		int16 array of shape (..., 2, samplecount), imag block first as stored on disk
+	dtype		np.complex128 or np.complex64 - gives (..., samplecount)
+			np.int16 - gives (..., samplecount, 2) real, imag pairs
+	out		optional preallocated destination of the right shape and dtype
+
+	complex64 is exact for int16 codes and takes half the memory
+	int16 pairs take a quarter of complex64
+	"""
+
+	dtype = np.dtype(dtype)
+	imag = raw[..., 0, :]
+	real = raw[..., 1, :]
+
+	if dtype == np.int16:
+		result = np.empty(real.shape + (2,), dtype=dtype) if out is None else out
+		result[..., 0] = real
+		result[..., 1] = imag
+
+		return result
+
+	assert dtype.kind == "c", f"Unsupported sample type {dtype}"
+
+	# https://github.com/numpy/numpy/issues/16039
+	result = np.empty(real.shape, dtype=dtype) if out is None else out
+	result.real = real
+	result.imag = imag
+
+	return result
+
 class ORDACap:
 	"""
 	A capture and its metadata
@@ -19,7 +67,8 @@ class ORDACap:
 	- Center frequency (Hz)
 	- Samplerate (Hz)
 	- Samplecount
-	- I/Q samples (complex128)
+	- Raw samples (int16, as stored)
+	- I/Q samples (decoded on first access, see decode_iq() for dtype)
 	"""
 
 	trigger_number = None
@@ -28,9 +77,10 @@ class ORDACap:
 	center_freq = None
 	samplerate = None
 	samplecount = None
-	iq = None
+	raw = None
+	dtype = None
 
-	def __init__(self, trigger_number, channel_number, timestamp, center_freq, samplerate, samplecount, iq_bytes):
+	def __init__(self, trigger_number, channel_number, timestamp, center_freq, samplerate, samplecount, iq_bytes, dtype=np.complex128):
 		self.trigger_number = trigger_number
 		self.channel_number = channel_number
 		self.timestamp = timestamp
@@ -38,12 +88,23 @@ class ORDACap:
 		self.samplerate = samplerate
 		self.samplecount = samplecount
 
-		imag, real = np.frombuffer(iq_bytes, dtype=np.int16).reshape(2, self.samplecount)
+		# No conversion yet - filtering by metadata should not pay for it
+		self.raw = np.frombuffer(iq_bytes, dtype=np.int16).reshape(2, self.samplecount)
+		self.dtype = dtype
+		self._iq = None
 
-		# https://github.com/numpy/numpy/issues/16039
-		self.iq = np.empty(self.samplecount, dtype=np.complex128)
-		self.iq.real = real
-		self.iq.imag = imag
+	@property
+	def iq(self):
+		"""
+		I/Q samples as self.dtype
+
+		Decoded from raw on first access and kept
+		"""
+
+		if self._iq is None:
+			self._iq = decode_iq(self.raw, self.dtype)
+
+		return self._iq
 
 	@property
 	def basic(self):
@@ -85,8 +146,56 @@ class ORDACap:
 			f"\n)"
 		)
 
+class ORDABatch:
+	"""
+	A stack of captures with metadata as parallel arrays
+
+	Stores:
+	- iq			(n, samplecount) samples, or (n, samplecount, 2) for int16
+	- trigger_number	(n,) uint64
+	- channel_number	(n,) uint8
+	- center_freq		(n,) int64, Hz
+	- timestamp		(n,) datetime64[us], UTC
+	- samplerate		Hz, same for the whole batch
+	- samplecount		same for the whole batch
+	"""
+
+	def __init__(self, iq, trigger_number, channel_number, center_freq, timestamp, samplerate, samplecount):
+		self.iq = iq
+		self.trigger_number = trigger_number
+		self.channel_number = channel_number
+		self.center_freq = center_freq
+		self.timestamp = timestamp
+		self.samplerate = samplerate
+		self.samplecount = samplecount
+
+	def __len__(self):
+		return self.iq.shape[0]
+
+	def __repr__(self):
+		return f"ORDABatch(n={len(self)}, samplecount={self.samplecount}, ...)"
+
 class StreamORDA:
-	def __init__(self, fd):
+	"""
+	Sequential ORDA reader
+
+	fd		file opened in binary mode
+	dtype		sample type of the captures produced, see decode_iq()
+	follow		tail-follow a file that is still being written:
+			None	a truncated trailing block is an error (default)
+			seconds	how long to wait for a partial trailing block to complete
+	poll		how often to check for more data when following, in seconds
+
+	Follow mode:
+
+	```
+	with open("xxxxxxx.ISE", "rb") as f:
+		for capture in StreamORDA(f, follow=10.0).captures:
+			print(capture) # Stops once the file has not grown for 10 s
+	```
+	"""
+
+	def __init__(self, fd, dtype=np.complex128, follow=None, poll=0.25):
 		self.type = None
 		self.data = None
 		self.center_freq = None
@@ -94,22 +203,20 @@ class StreamORDA:
 		self.samples = None
 		self.channel = None
 		self.timestamp = None
+		self.trigger_number = None
+		self.held = False
 		self.ch_blocks = [0, 0, 0, 0]
+		self.dtype = dtype
+		self.follow = follow
+		self.poll = poll
 		self.fd = fd
 
 	def parse_superheader(self, type, header):
-		fields = len(header) / 4
-		pairs = {}
-
-		assert fields % 1 == 0
+		assert len(header) % 4 == 0
 
-		for i in range( int(fields) ):
-			k_lo, k_hi, v_lo, v_hi = header[i*4:(i+1)*4]
-
-			k = k_hi*256 + k_lo
-			v = v_hi*256 + v_lo
-
-			pairs[k] = v
+		# Little endian (key, value) u16 pairs; later keys win, as they would in a loop
+		kv = np.frombuffer(header, dtype="<u2").reshape(-1, 2)
+		pairs = dict( zip(kv[:, 0].tolist(), kv[:, 1].tolist()) )
 
 		# Useful
 		# print(pairs, type)
@@ -132,40 +239,84 @@ class StreamORDA:
 			) + timedelta(microseconds = pairs[13] * 1000) # Microseconds added as offset bc pairs[13]*1000 is sometimes 1000000 which is not valid for datetime()
 
 	def advance(self):
-		header = self.fd.read(9)
+		if self.follow is None:
+			header = self.fd.read(9)
 
-		if len(header) == 0:
-			return False
+			if len(header) == 0:
+				return False
 
-		orda_magic, type, size = struct.unpack("<4sBI", header)
-		data = self.fd.read(size)
+			orda_magic, type, size = struct.unpack("<4sBI", header)
+			data = self.fd.read(size)
 
-		assert orda_magic == b"ORDA"
-		assert len(data) == size
+			assert orda_magic == b"ORDA"
+			assert len(data) == size
+		else:
+			block = self.advance_follow()
+
+			if block is None:
+				return False
+
+			type, data = block
 
 		self.type = type
 		self.data = data
 
 		return True
 
-	def read_capture(self):
+	def advance_follow(self):
+		"""
+		Read one block off a file that may still be growing
+
+		A partial block is rewound and retried until it completes;
+		gives up once the file has made no progress for self.follow seconds
+		"""
+
+		start = self.fd.tell()
+		best = 0
+		deadline = time.monotonic() + self.follow
+
+		while True:
+			header = self.fd.read(9)
+			data = b""
+
+			if len(header) == 9:
+				orda_magic, type, size = struct.unpack("<4sBI", header)
+
+				assert orda_magic == b"ORDA"
+
+				data = self.fd.read(size)
+
+				if len(data) == size:
+					return type, data
+
+			# Partial trailing block - wait for the writer
+			self.fd.seek(start)
+
+			if len(header) + len(data) > best:
+				best = len(header) + len(data)
+				deadline = time.monotonic() + self.follow
+
+			if time.monotonic() >= deadline:
+				return None
+
+			time.sleep(self.poll)
+
+	def next_iq_block(self):
+		"""
+		Advance to the next I/Q block, parsing headers along the way
+
+		Sets self.trigger_number and leaves the payload in self.data
+		Returns False at the end of the stream
+		"""
+
 		while self.advance():
 			if self.type == 3: # Global header
 				self.parse_superheader(self.type, self.data)
 			elif self.type == 2: # I/Q Samples
-				result = ORDACap(
-					trigger_number=self.ch_blocks[self.channel],
-					channel_number=self.channel,
-					timestamp=self.timestamp,
-					center_freq=self.center_freq,
-					samplerate=self.samplerate,
-					samplecount=self.samples,
-					iq_bytes=bytearray(self.data)
-				)
-
+				self.trigger_number = self.ch_blocks[self.channel]
 				self.ch_blocks[self.channel] += 1
 
-				return result
+				return True
 			elif self.type == 1: # Local header
 				self.parse_superheader(self.type, self.data)
 			else:
@@ -173,7 +324,23 @@ class StreamORDA:
 
 		#print(f"orda_stream block count: {self.ch_blocks}")
 
-		return None
+		return False
+
+	def read_capture(self):
+		if not self.next_iq_block():
+			return None
+
+		# No copy: ORDACap only ever reads from the payload
+		return ORDACap(
+			trigger_number=self.trigger_number,
+			channel_number=self.channel,
+			timestamp=self.timestamp,
+			center_freq=self.center_freq,
+			samplerate=self.samplerate,
+			samplecount=self.samples,
+			iq_bytes=self.data,
+			dtype=self.dtype
+		)
 
 	@property
 	def captures(self):
@@ -220,6 +387,85 @@ class StreamORDA:
 			else:
 				return
 
+	def read_batch(self, n):
+		"""
+		Read up to n captures into one preallocated stack
+
+		A batch ends early if the samplecount changes midway;
+		the offending block is held over for the next batch
+
+		Returns None at the end of the stream
+		"""
+
+		batch = None
+		k = 0
+
+		while k < n:
+			if self.held:
+				self.held = False
+			elif not self.next_iq_block():
+				break
+
+			if batch is None:
+				shape = (n, self.samples) + ((2,) if np.dtype(self.dtype) == np.int16 else ())
+
+				batch = ORDABatch(
+					iq=np.empty(shape, dtype=self.dtype),
+					trigger_number=np.empty(n, dtype=np.uint64),
+					channel_number=np.empty(n, dtype=np.uint8),
+					center_freq=np.empty(n, dtype=np.int64),
+					timestamp=np.empty(n, dtype="datetime64[us]"),
+					samplerate=self.samplerate,
+					samplecount=self.samples
+				)
+			elif self.samples != batch.samplecount:
+				self.held = True
+				break
+
+			raw = np.frombuffer(self.data, dtype=np.int16).reshape(2, self.samples)
+			decode_iq(raw, self.dtype, out=batch.iq[k])
+
+			batch.trigger_number[k] = self.trigger_number
+			batch.channel_number[k] = self.channel
+			batch.center_freq[k] = self.center_freq
+			batch.timestamp[k] = self.timestamp.replace(tzinfo=None) if self.timestamp else None
+
+			k += 1
+
+		if batch is None:
+			return None
+
+		if k < n:
+			batch.iq = batch.iq[:k]
+			batch.trigger_number = batch.trigger_number[:k]
+			batch.channel_number = batch.channel_number[:k]
+			batch.center_freq = batch.center_freq[:k]
+			batch.timestamp = batch.timestamp[:k]
+
+		return batch
+
+	def batches(self, n=256):
+		"""
+		Iterator for ORDABatch objects of up to n captures
+
+		Example:
+
+		```
+		with open("xxxxxxx.ISE", "rb") as f:
+			for batch in MappedORDA(f).batches(1024):
+				print(batch.iq.shape, np.unique(batch.center_freq))
+		```
+
+		"""
+
+		while True:
+			result = self.read_batch(n)
+
+			if result:
+				yield result
+			else:
+				return
+
 	def all_captures(self):
 		"""
 		Returns a list of captures, no iterators
@@ -233,3 +479,224 @@ class StreamORDA:
 
 		"""
 		return list(self.captures)
+
+class ORDAWriter:
+	"""
+	Writer counterpart of StreamORDA
+
+	Emits the block types StreamORDA understands:
+	- 3	Global header (samplerate, samplecount)
+	- 1	Local header (channel, center frequency, timestamp)
+	- 2	I/Q samples
+
+	Example:
+
+	```
+	with open("xxxxxxx.ISE", "wb") as f:
+		writer = ORDAWriter(f)
+		writer.write_global_header(5*1000*1000, 8192)
+		writer.write_capture(1, 154*1000*1000, datetime.now(timezone.utc), iq)
+	```
+	"""
+
+	def __init__(self, fd):
+		self.fd = fd
+
+	def write_block(self, type, payload):
+		self.fd.write( struct.pack("<4sBI", b"ORDA", type, len(payload)) )
+		self.fd.write(payload)
+
+	def write_superheader(self, type, pairs):
+		kv = np.array(list(pairs.items()), dtype="<u2")
+		self.write_block(type, kv.tobytes())
+
+	def write_global_header(self, samplerate, samplecount):
+		assert samplerate % 1000 == 0, "Samplerate is stored in kHz"
+
+		self.write_superheader(3, {
+			30: samplerate // 1000,
+			3: samplecount
+		})
+
+	def write_local_header(self, channel, center_freq, timestamp):
+		assert center_freq % 1000 == 0, "Center frequency is stored in kHz"
+
+		khz = int(center_freq) // 1000
+		timestamp = timestamp.astimezone(timezone.utc)
+
+		self.write_superheader(1, {
+			7: channel,
+			9: timestamp.year,
+			10: timestamp.month*256 + timestamp.day,
+			11: timestamp.minute*256 + timestamp.hour,
+			12: timestamp.second,
+			13: timestamp.microsecond // 1000,
+			16: khz % 65536,
+			17: khz // 65536
+		})
+
+	def write_samples(self, iq):
+		"""
+		Takes complex samples or int16 (samplecount, 2) real, imag pairs
+
+		Complex samples are rounded and saturated to int16
+		"""
+
+		if np.iscomplexobj(iq):
+			real = np.clip(np.round(iq.real), -32768, 32767)
+			imag = np.clip(np.round(iq.imag), -32768, 32767)
+		else:
+			real = iq[:, 0]
+			imag = iq[:, 1]
+
+		raw = np.vstack([imag, real]).astype("<i2")
+		self.write_block(2, raw.tobytes())
+
+	def write_capture(self, channel, center_freq, timestamp, iq):
+		self.write_local_header(channel, center_freq, timestamp)
+		self.write_samples(iq)
+
+class MappedORDA(StreamORDA):
+	"""
+	Memory-mapped flavour of StreamORDA
+
+	Maps the whole file once and walks the blocks in place:
+	- No read() syscalls per block
+	- Payloads are memoryview slices into the mapping, not copies
+
+	Same iterators as StreamORDA:
+
+	```
+	with open("xxxxxxx.ISE", "rb") as f:
+		for capture in MappedORDA(f).captures:
+			print( str(capture) )
+	```
+
+	Views handed out keep the mapping alive, so captures remain valid after the file is closed
+	"""
+
+	def __init__(self, fd, dtype=np.complex128):
+		super().__init__(fd, dtype)
+
+		# mmap() refuses empty files
+		if os.fstat(fd.fileno()).st_size:
+			self.buffer = memoryview( mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) )
+		else:
+			self.buffer = memoryview(b"")
+
+		self.offset = 0
+
+	def advance(self):
+		if self.offset == len(self.buffer):
+			return False
+
+		orda_magic, type, size = struct.unpack_from("<4sBI", self.buffer, self.offset)
+		start = self.offset + 9
+
+		assert orda_magic == b"ORDA"
+		assert start + size <= len(self.buffer)
+
+		self.type = type
+		self.data = self.buffer[start:start + size]
+		self.offset = start + size
+
+		return True
+
+	def capture_at(self, row):
+		"""
+		Random access to a capture described by an index row
+
+		```
+		with open("xxxxxxx.ISE", "rb") as f:
+			stream = MappedORDA(f)
+			index = load_orda_index("xxxxxxx.ISE")
+			capture = stream.capture_at(index[-1])
+		```
+		"""
+
+		offset = int(row["offset"])
+		samplecount = int(row["samplecount"])
+
+		return capture_from_index(row, self.buffer[offset:offset + samplecount*4], self.dtype)
+
+def capture_from_index(row, iq_bytes, dtype=np.complex128):
+	"""
+	Make an ORDACap out of an index row and the block's payload
+	"""
+
+	timestamp = None
+
+	if not np.isnat(row["timestamp"]):
+		timestamp = row["timestamp"].astype(datetime).replace(tzinfo=timezone.utc)
+
+	return ORDACap(
+		trigger_number=int(row["trigger"]),
+		channel_number=int(row["channel"]),
+		timestamp=timestamp,
+		center_freq=int(row["center_freq"]),
+		samplerate=int(row["samplerate"]),
+		samplecount=int(row["samplecount"]),
+		iq_bytes=iq_bytes,
+		dtype=dtype
+	)
+
+def index_orda(fd):
+	"""
+	One pass over an ORDA file, recording every I/Q block's metadata
+
+	Returns a structured array of ORDA_INDEX_DTYPE
+	"""
+
+	stream = MappedORDA(fd)
+	rows = []
+
+	while stream.next_iq_block():
+		timestamp = stream.timestamp.replace(tzinfo=None) if stream.timestamp else None
+
+		rows.append((
+			stream.offset - len(stream.data),
+			stream.channel,
+			stream.center_freq,
+			stream.samplerate,
+			stream.samples,
+			timestamp,
+			stream.trigger_number
+		))
+
+	return np.array(rows, dtype=ORDA_INDEX_DTYPE)
+
+def load_orda_index(filename, sidecar=True):
+	"""
+	Block index of an ORDA file, cached in a sidecar file
+
+	The sidecar is {filename}.idx.npz and is reused as long as
+	the file's size and mtime have not changed
+
+	Unwritable locations are tolerated: the index is then rebuilt every time
+	"""
+
+	st = os.stat(filename)
+	stamp = np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)
+	path = f"{filename}.idx.npz"
+
+	if sidecar and os.path.exists(path):
+		try:
+			with np.load(path) as z:
+				if np.array_equal(z["stamp"], stamp) and z["index"].dtype == ORDA_INDEX_DTYPE:
+					return z["index"]
+		except (OSError, ValueError, KeyError):
+			pass # Corrupt or stale, rebuild
+
+	with open(filename, "rb") as f:
+		index = index_orda(f)
+
+	if sidecar:
+		try:
+			with open(path + ".tmp", "wb") as f:
+				np.savez(f, index=index, stamp=stamp)
+
+			os.replace(path + ".tmp", path)
+		except OSError:
+			pass
+
+	return index
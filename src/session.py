@@ -0,0 +1,533 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from glob import glob
+import shutil
+import copy
+import time
+import os
+
+import numpy as np
+
+from .orda import StreamORDA, MappedORDA, ORDABatch, ORDA_INDEX_DTYPE, load_orda_index, decode_iq, capture_from_index
+
+#
+# Session level access to captures
+#
+# A session is a directory holding a preset.json and a number of .ISE files
+# written one after another by the DDC
+#
+# A session archive is a directory converted from a session once, with:
+# - preset.json	copied as is
+# - index.npy	SESSION_INDEX_DTYPE columns, offset being the row in iq.npy
+# - iq.npy	int16 (n, 2, samplecount) raw samples of all captures, contiguous
+#
+# Archives open in milliseconds and are sliced straight out of a memory mapping
+#
+
+# Block index record extended with the file number within a session
+SESSION_INDEX_DTYPE = np.dtype(ORDA_INDEX_DTYPE.descr + [("file", "<u2")])
+
+def as_datetime64(ts):
+	"""
+	Convert a timezone-aware datetime into a naive UTC numpy datetime64
+	"""
+
+	if isinstance(ts, np.datetime64):
+		return ts.astype("datetime64[us]")
+
+	if ts.tzinfo is not None:
+		ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+
+	return np.datetime64(ts, "us")
+
+class CaptureSet:
+	"""
+	Indexed, lazily decoded collection of captures
+
+	Opening a session costs one pass over the block headers (cached in sidecars)
+	I/Q is only decoded for the blocks that survive a query
+
+	Trigger numbers are per-channel and global across the session,
+	i.e. they keep counting from one file into the next
+
+	Files are indexed and decoded concurrently in a thread pool of `workers` threads
+	(None for the executor's default, 1 to stay on the calling thread);
+	the mappings let numpy copy out of page cache without holding the GIL for long.
+	A pool only lives for one pass, so idle sets and their copies hold no threads
+
+	`location` may also be a session archive, see convert_session()
+
+	Example:
+
+	```
+	captures = CaptureSet("calibrator_v1_2025-07-09T07_21_28+00_00")
+	captures = captures[captures.center_freq != 0] # DDC quirk
+
+	repeats = captures.select(channel=1, center_freq=154*1000*1000, since=since, until=until)
+	iq = repeats.iq() # (n, samplecount)
+	```
+	"""
+
+	def __init__(self, location, workers=None):
+		self.workers = workers
+		self.groups = None
+		self.archive = None
+
+		if os.path.exists(f"{location}/iq.npy"):
+			self.filenames = []
+			self.streams = []
+			self.archive = np.load(f"{location}/iq.npy", mmap_mode="r")
+			self.index = np.load(f"{location}/index.npy")
+			self.session_samplecount = self.archive.shape[-1]
+
+			return
+
+		filenames = sorted(glob(f"{location}/*.ISE"))
+
+		streams = []
+		indices = []
+		ch_blocks = np.zeros(256, dtype=np.uint64)
+
+		# Map preserves filename order
+		for i, index in enumerate(self.map(load_orda_index, filenames)):
+			with open(filenames[i], "rb") as f:
+				streams.append( MappedORDA(f) )
+
+			session_index = np.empty(len(index), dtype=SESSION_INDEX_DTYPE)
+
+			for name in ORDA_INDEX_DTYPE.names:
+				session_index[name] = index[name]
+
+			# Continue trigger numbering from the previous file
+			session_index["trigger"] += ch_blocks[index["channel"]]
+			session_index["file"] = i
+
+			ch_blocks += np.bincount(index["channel"], minlength=256).astype(np.uint64)
+
+			indices.append(session_index)
+
+		self.filenames = filenames
+		self.streams = streams
+		self.index = np.concatenate(indices) if indices else np.empty(0, dtype=SESSION_INDEX_DTYPE)
+
+		# Capture length of the whole session, kept by empty selections
+		samplecount = np.unique(self.index["samplecount"])
+		self.session_samplecount = int(samplecount[0]) if len(samplecount) == 1 else 0
+
+	def map(self, fn, items):
+		"""
+		List of fn(item) over items, in order
+
+		The pool only lives for the call, so no threads outlive the work
+		"""
+
+		if self.workers == 1:
+			return [fn(x) for x in items]
+
+		with ThreadPoolExecutor(self.workers) as pool:
+			return list(pool.map(fn, items))
+
+	def __len__(self):
+		return len(self.index)
+
+	def __getitem__(self, key):
+		"""
+		Subset by a boolean mask, an index array or a slice
+		"""
+
+		result = copy.copy(self)
+		result.index = np.atleast_1d(self.index[key])
+		result.groups = None
+
+		return result
+
+	@property
+	def channel_number(self):
+		return self.index["channel"]
+
+	@property
+	def center_freq(self):
+		return self.index["center_freq"]
+
+	@property
+	def trigger_number(self):
+		return self.index["trigger"]
+
+	@property
+	def timestamp(self):
+		return self.index["timestamp"]
+
+	@property
+	def samplecount(self):
+		return self.index["samplecount"]
+
+	@property
+	def channels(self):
+		return set(np.unique(self.channel_number).tolist())
+
+	def group(self, channel, center_freq):
+		"""
+		Row numbers of captures at a given channel and frequency
+
+		Groups are established once, then every lookup is a dict access
+		"""
+
+		if self.groups is None:
+			keys = self.index[["channel", "center_freq"]]
+			unique, inverse = np.unique(keys, return_inverse=True)
+			order = np.argsort(inverse, kind="stable")
+			bounds = np.cumsum(np.bincount(inverse.ravel(), minlength=len(unique)))
+
+			self.groups = {
+				(int(k["channel"]), int(k["center_freq"])): rows
+				for k, rows in zip(unique, np.split(order, bounds[:-1]))
+			}
+
+		return self.groups.get( (channel, center_freq), np.empty(0, dtype=np.intp) )
+
+	def select(self, channel=None, center_freq=None, triggers=None, since=None, until=None):
+		"""
+		Query captures by metadata
+
+		channel			channel number
+		center_freq		center frequency in Hz
+		triggers		range of trigger numbers, e.g. range(100, 200)
+		since			timestamp lower bound (inclusive), a datetime
+		until			timestamp upper bound (exclusive), a datetime
+
+		Returns a CaptureSet; nothing is decoded
+		"""
+
+		if channel is not None and center_freq is not None:
+			result = self[self.group(channel, center_freq)]
+		else:
+			result = self
+
+		mask = np.ones(len(result), dtype=bool)
+
+		if channel is not None:
+			mask &= result.channel_number == channel
+
+		if center_freq is not None:
+			mask &= result.center_freq == center_freq
+
+		if triggers is not None:
+			mask &= (result.trigger_number >= triggers.start) & (result.trigger_number < triggers.stop)
+
+		if since is not None:
+			mask &= result.timestamp >= as_datetime64(since)
+
+		if until is not None:
+			mask &= result.timestamp < as_datetime64(until)
+
+		return result[mask]
+
+	def decode(self, dtype=None):
+		"""
+		Decode the selected blocks into one preallocated stack
+
+		dtype		None to keep int16 as stored, otherwise see decode_iq()
+
+		Every file is handled by its own worker, each filling its own rows
+
+		An empty selection still has the session's capture length,
+		unless the session mixes lengths (or has no captures), then it is 0
+		"""
+
+		samplecount = np.unique(self.samplecount)
+
+		assert len(samplecount) <= 1, "Captures of different length cannot be stacked"
+
+		samplecount = int(samplecount[0]) if len(samplecount) else self.session_samplecount
+
+		if self.archive is not None:
+			# Fancy indexing copies just the selected rows out of the mapping
+			raw = self.archive[self.index["offset"].astype(np.intp)]
+
+			return raw if dtype is None else decode_iq(raw, dtype)
+
+		if dtype is None:
+			result = np.empty([len(self), 2, samplecount], dtype=np.int16)
+		elif np.dtype(dtype) == np.int16:
+			result = np.empty([len(self), samplecount, 2], dtype=dtype)
+		else:
+			result = np.empty([len(self), samplecount], dtype=dtype)
+
+		files = self.index["file"]
+		offsets = self.index["offset"]
+
+		def fill(file):
+			buffer = self.streams[file].buffer
+
+			for i in np.flatnonzero(files == file):
+				raw = np.frombuffer(buffer, dtype=np.int16, count=2*samplecount, offset=int(offsets[i]))
+				raw = raw.reshape(2, samplecount)
+
+				if dtype is None:
+					result[i] = raw
+				else:
+					decode_iq(raw, dtype, out=result[i])
+
+		self.map(fill, np.unique(files))
+
+		return result
+
+	def raw(self):
+		"""
+		Decode the selected blocks into int16 as they are stored on disk
+
+		Returns an array of shape (n, 2, samplecount) - imag first, then real
+		"""
+
+		return self.decode(None)
+
+	def iq(self, dtype=np.complex128):
+		"""
+		Decode the selected blocks into I/Q samples
+
+		Returns an array of shape (n, samplecount), or (n, samplecount, 2) for int16, see decode_iq()
+		"""
+
+		return self.decode(dtype)
+
+	def batch(self, dtype=np.complex128):
+		"""
+		Decode the selected blocks into an ORDABatch, in session order
+		"""
+
+		samplerate = np.unique(self.index["samplerate"])
+
+		return ORDABatch(
+			iq=self.iq(dtype),
+			trigger_number=self.trigger_number.copy(),
+			channel_number=self.channel_number.copy(),
+			center_freq=self.center_freq.copy(),
+			timestamp=self.timestamp.copy(),
+			samplerate=int(samplerate[0]) if len(samplerate) else None,
+			samplecount=int(self.samplecount[0]) if len(self) else self.session_samplecount
+		)
+
+	def batches(self, n=256, dtype=np.complex128):
+		"""
+		Iterator for ORDABatch objects of up to n captures, in session order
+
+		Only one batch is decoded at a time
+		"""
+
+		for start in range(0, len(self), n):
+			yield self[start:start + n].batch(dtype)
+
+	@property
+	def captures(self):
+		"""
+		Iterator for ORDACap objects, for code that wants them one by one
+		"""
+
+		for row in self.index:
+			if self.archive is not None:
+				yield capture_from_index(row, self.archive[int(row["offset"])])
+			else:
+				yield self.streams[row["file"]].capture_at(row)
+
+def load_session(location, dtype=np.complex128, workers=None):
+	"""
+	Read every capture of a session directory into one ORDABatch
+
+	Files are parsed and decoded concurrently, then merged in filename order;
+	trigger numbers are global across the session
+
+	Example:
+
+	```
+	batch = load_session("calibrator_v1_2025-07-09T07_21_28+00_00", dtype=np.complex64)
+	batch.iq[batch.channel_number == 1]
+	```
+	"""
+
+	return CaptureSet(location, workers=workers).batch(dtype)
+
+def follow_session(location, idle=60.0, poll=0.25, dtype=np.complex128, heartbeat=False):
+	"""
+	Yield captures of a session while the DDC is still writing it
+
+	Files are followed in filename order; a file is considered complete
+	once a newer one shows up. Trigger numbers are global across the session
+
+	Stops once nothing new has arrived for `idle` seconds
+	With `heartbeat`, None is yielded after every poll that brought nothing,
+	so that the caller gets to do periodic work while waiting
+
+	Example:
+
+	```
+	for capture in follow_session(dirpath):
+		print(capture)
+	```
+	"""
+
+	def newer(filename):
+		return [x for x in sorted(glob(f"{location}/*.ISE")) if x > filename]
+
+	ch_blocks = [0, 0, 0, 0]
+	previous = ""
+	last = time.monotonic()
+
+	while True:
+		pending = newer(previous)
+
+		if not pending:
+			if time.monotonic() - last > idle:
+				return
+
+			time.sleep(poll)
+
+			if heartbeat:
+				yield None
+
+			continue
+
+		previous = pending[0]
+
+		with open(previous, "rb") as f:
+			stream = StreamORDA(f, dtype=dtype, follow=poll, poll=poll)
+			stream.ch_blocks = ch_blocks
+
+			while True:
+				capture = stream.read_capture()
+
+				if capture:
+					last = time.monotonic()
+					yield capture
+					continue
+
+				if newer(previous):
+					# The writer has moved on, drain whatever is complete
+					stream.follow = 0.0
+
+					for capture in stream.captures:
+						yield capture
+
+					break
+
+				if time.monotonic() - last > idle:
+					return
+
+				if heartbeat:
+					yield None
+
+def follow_batches(location, interval=5.0, idle=60.0, poll=0.25, dtype=np.complex128):
+	"""
+	Follow a session while the DDC is still writing it, see follow_session(),
+	yielding an ORDABatch of whatever has arrived every `interval` seconds
+
+	Intervals that brought nothing are skipped;
+	a batch ends early if the samplecount changes midway
+
+	Example:
+
+	```
+	for batch in follow_batches(dirpath, interval=10.0):
+		print(batch.iq.shape, np.unique(batch.center_freq))
+	```
+	"""
+
+	pending = []
+	last = time.monotonic()
+
+	def batch():
+		return ORDABatch(
+			iq=np.stack([x.iq for x in pending]),
+			trigger_number=np.array([x.trigger_number for x in pending], dtype=np.uint64),
+			channel_number=np.array([x.channel_number for x in pending], dtype=np.uint8),
+			center_freq=np.array([x.center_freq for x in pending], dtype=np.int64),
+			timestamp=np.array([x.timestamp.replace(tzinfo=None) if x.timestamp else None for x in pending], dtype="datetime64[us]"),
+			samplerate=pending[0].samplerate,
+			samplecount=pending[0].samplecount
+		)
+
+	for capture in follow_session(location, idle=idle, poll=poll, dtype=dtype, heartbeat=True):
+		if capture is not None:
+			if pending and capture.samplecount != pending[0].samplecount:
+				yield batch()
+				pending = []
+
+			pending.append(capture)
+
+		if pending and time.monotonic() - last >= interval:
+			yield batch()
+			pending = []
+			last = time.monotonic()
+
+	if pending:
+		yield batch()
+
+def stream_session(location, n=256, dtype=np.complex128):
+	"""
+	Walk a session once, yielding ORDABatch objects of up to n captures
+
+	Files are read block by block in filename order; only the batch at hand is held,
+	so memory use does not depend on session length.
+	Trigger numbers are global across the session
+
+	Example:
+
+	```
+	for batch in stream_session(dirpath, dtype=np.complex64):
+		print(batch.iq.shape, np.unique(batch.center_freq))
+	```
+	"""
+
+	if os.path.exists(f"{location}/iq.npy"):
+		for batch in CaptureSet(location, workers=1).batches(n, dtype):
+			yield batch
+
+		return
+
+	ch_blocks = [0, 0, 0, 0]
+
+	for filename in sorted(glob(f"{location}/*.ISE")):
+		with open(filename, "rb") as f:
+			stream = StreamORDA(f, dtype=dtype)
+			stream.ch_blocks = ch_blocks
+
+			for batch in stream.batches(n):
+				yield batch
+
+def convert_session(location, destination, workers=None):
+	"""
+	Convert a session directory (preset.json + *.ISE) into a session archive
+
+	The I/Q is written file by file into a memory-mapped .npy,
+	so sessions larger than RAM convert fine
+	"""
+
+	captures = CaptureSet(location, workers=workers)
+	samplecount = np.unique(captures.samplecount)
+
+	assert len(samplecount) <= 1, "Captures of different length cannot be archived together"
+
+	samplecount = int(samplecount[0]) if len(samplecount) else 0
+
+	os.makedirs(destination)
+	shutil.copy(f"{location}/preset.json", f"{destination}/preset.json")
+
+	iq = np.lib.format.open_memmap(
+		f"{destination}/iq.npy",
+		mode="w+",
+		dtype=np.int16,
+		shape=(len(captures), 2, samplecount)
+	)
+
+	files = captures.index["file"]
+
+	for file in np.unique(files):
+		rows = np.flatnonzero(files == file)
+		iq[rows] = captures[rows].raw()
+
+	iq.flush()
+
+	index = captures.index.copy()
+	index["offset"] = np.arange(len(index))
+	index["file"] = 0
+
+	np.save(f"{destination}/index.npy", index)
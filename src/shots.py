@@ -0,0 +1,174 @@
+import numpy as np
+
+#
+# Coherent multi-channel captures
+#
+# The DDC captures every trigger on all active channels at once
+# and writes the blocks one after another:
+#
+#	ch1 ch3 ch1 ch3 ch1 ch3 ...
+#
+# A shot is one such run of captures, one per channel, all at the same center frequency
+# Shots are numbered globally across the session, 0 Hz captures (a DDC quirk) aside;
+# a preset's signals are triggered in turn, so shot k carries signal k % len(signals)
+#
+
+class ShotAssembler:
+	"""
+	Groups captures into shots as they are read
+
+	tunes		center frequency of every signal in the preset, in Hz
+	channels	channel numbers expected in every shot;
+			None to learn them from the first shot
+
+	A shot is complete once every channel has been seen;
+	a channel showing up twice before that means a capture went missing,
+	a channel that is not expected means an extra one. Both fail an assertion,
+	as does a shot at the wrong center frequency
+
+	Example:
+
+	```
+	assembler = ShotAssembler(tunes)
+
+	for batch in stream_session(dirpath):
+		for signal_idx, shot_idx, iq in assembler.feed(batch):
+			print(signal_idx, shot_idx, iq.shape) # (channels, frames)
+
+	for signal_idx, shot_idx, iq in assembler.close():
+		print(signal_idx, shot_idx, iq.shape)
+	```
+	"""
+
+	def __init__(self, tunes, channels=None):
+		self.tunes = list(tunes)
+		self.channels = sorted(channels) if channels is not None else None
+		self.shot_idx = 0
+		self.current = {}
+		self.center_freq = None
+
+	def complete(self):
+		"""
+		Turn the captures gathered so far into a shot
+		"""
+
+		if self.channels is None:
+			self.channels = sorted(self.current)
+
+		assert sorted(self.current) == self.channels, f"Shot {self.shot_idx} has channels {sorted(self.current)}, expected {self.channels}"
+
+		signal_idx = self.shot_idx % len(self.tunes)
+
+		assert self.center_freq == self.tunes[signal_idx], f"Shot {self.shot_idx} is at {self.center_freq} Hz, expected {self.tunes[signal_idx]} Hz"
+
+		result = (signal_idx, self.shot_idx, np.stack([self.current[ch] for ch in self.channels]))
+
+		self.shot_idx += 1
+		self.current = {}
+		self.center_freq = None
+
+		return result
+
+	def add(self, channel, center_freq, iq):
+		"""
+		Take one capture
+
+		Returns a list of shots completed by it, (signal_idx, shot_idx, iq[channels, frames])
+		"""
+
+		result = []
+
+		if center_freq == 0:
+			return result # DDC quirk: 0 Hz must be skipped
+
+		if self.channels is not None:
+			assert channel in self.channels, f"Shot {self.shot_idx} has an extra channel {channel}, expected {self.channels}"
+
+		# Only happens when the channels are not known yet,
+		# or a capture went missing
+		if channel in self.current:
+			result.append( self.complete() )
+
+		if self.center_freq is None:
+			self.center_freq = center_freq
+
+		assert center_freq == self.center_freq, f"Shot {self.shot_idx} mixes {self.center_freq} Hz and {center_freq} Hz"
+
+		self.current[channel] = iq
+
+		if self.channels is not None and len(self.current) == len(self.channels):
+			result.append( self.complete() )
+
+		return result
+
+	def feed(self, batch):
+		"""
+		Take an ORDABatch
+
+		Returns a list of shots completed by it, (signal_idx, shot_idx, iq[channels, frames]);
+		a shot may span batches
+		"""
+
+		result = []
+
+		for i in range(len(batch)):
+			result += self.add( int(batch.channel_number[i]), int(batch.center_freq[i]), batch.iq[i] )
+
+		return result
+
+	def batches(self, batches):
+		"""
+		Group the captures of a sequence of ORDABatch objects into shots,
+		stacked per signal
+
+		Yields (signal_idx, shot_idx, iq) with:
+
+		shot_idx	(k,) shot numbers
+		iq		(k, channels, frames), channels in the order of self.channels
+
+		Example:
+
+		```
+		assembler = ShotAssembler(tunes)
+
+		for signal_idx, shot_idx, iq in assembler.batches(stream_session(dirpath)):
+			u = iq[:, assembler.channels.index(1)]
+			v = iq[:, assembler.channels.index(3)]
+		```
+		"""
+
+		for batch in batches:
+			for result in self.group(self.feed(batch)):
+				yield result
+
+		for result in self.group(self.close()):
+			yield result
+
+	def group(self, shots):
+		"""
+		Stack a list of shots, as returned by feed() or close(), per signal
+
+		Yields (signal_idx, shot_idx, iq) like batches();
+		for callers that feed batches as they come and close the session themselves
+		"""
+
+		for signal_idx in sorted(set([x[0] for x in shots])):
+			selected = [x for x in shots if x[0] == signal_idx]
+
+			yield (
+				signal_idx,
+				np.array([x[1] for x in selected]),
+				np.stack([x[2] for x in selected])
+			)
+
+	def close(self):
+		"""
+		Call at the end of the session
+
+		Returns the last shot if it could not be told complete before, i.e. when channels were being learned
+		"""
+
+		if not self.current:
+			return []
+
+		return [self.complete()]
@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta, timezone
+import json
+import os
+
+import numpy as np
+
+from .misc import parse_freq_expr
+from .orda import ORDAWriter
+from .workflows import load_models
+
+#
+# Synthetic sessions for load testing and regression testing without the DDC
+#
+# Mimics what a calibrator_v1 session looks like on disk:
+# - preset.json
+# - A number of .ISE files, triggers cycling through the preset's signals
+# - Every trigger captured coherently on all channels
+#
+
+def synthesize_session(
+	location,
+	preset,
+	channels=(1, 3),
+	repeats=10,
+	files=1,
+	delay=0.0,
+	jitter=0.0,
+	noise=0.0,
+	phase_offset=None,
+	random_phase=True,
+	rate=25.0,
+	start=None,
+	seed=None
+):
+	"""
+	Write a synthetic session directory
+
+	location	directory to be created
+	preset		preset object as loaded from json, {"ddc-and-calibrator-v1": {...}} or v2
+	channels	channel numbers to capture on
+	repeats		how many times every signal gets triggered
+	files		how many .ISE files to spread the triggers across
+	delay		trigger delay in seconds, same for all channels
+	jitter		rms trigger delay jitter in seconds, per trigger
+	noise		rms noise per I and Q, in ADC codes
+	phase_offset	dict of channel -> phase offset in degrees
+	random_phase	apply a random phase per trigger, as the DDC's LO does
+	rate		triggers per second, for timestamps
+	start		timestamp of the first trigger
+	seed		random seed
+
+	Signals are modelled with ModelSignalV1 or ModelSignalV2, i.e. with DDC's perceived amplitude;
+	the DDC's 0 Hz quirk capture is emitted once per channel at the start
+	"""
+
+	rng = np.random.default_rng(seed)
+	start = start or datetime(2025, 1, 1, tzinfo=timezone.utc)
+	phase_offset = phase_offset or {}
+
+	parsed, signals = load_models(preset)
+
+	samplerate = parse_freq_expr(parsed.ddc.samplerate)
+	frames = parsed.ddc.frames
+
+	# Fractional delays are applied in frequency domain
+	spectra = [np.fft.fft(signal.iq) for signal in signals]
+	bins = np.fft.fftfreq(frames)
+
+	rotators = np.array([ np.exp(1j*np.pi*phase_offset.get(ch, 0.0)/180.0) for ch in channels ])
+
+	os.makedirs(location)
+
+	with open(f"{location}/preset.json", "w") as f:
+		f.write( json.dumps(preset, indent=2) )
+
+	triggers = repeats * len(signals)
+	per_file = -(-triggers // files)
+
+	for file in range(files):
+		with open(f"{location}/{file:06}.ISE", "wb") as f:
+			writer = ORDAWriter(f)
+			writer.write_global_header(samplerate, frames)
+
+			if file == 0:
+				for ch in channels:
+					writer.write_capture(ch, 0, start, np.zeros(frames, dtype=np.complex64))
+
+			for trigger in range(file*per_file, min((file + 1)*per_file, triggers)):
+				i = trigger % len(signals)
+				tune = parse_freq_expr(signals[i].descriptor.tune)
+				timestamp = start + timedelta(seconds=trigger/rate)
+
+				shift = (delay + jitter*rng.standard_normal()) * samplerate
+				iq = np.fft.ifft( spectra[i] * np.exp(-2j*np.pi*bins*shift) )
+
+				if random_phase:
+					iq *= np.exp(2j*np.pi*rng.random())
+
+				iq = iq[None, :] * rotators[:, None]
+
+				if noise:
+					iq += noise * (rng.standard_normal(iq.shape) + 1j*rng.standard_normal(iq.shape))
+
+				for ch, x in zip(channels, iq):
+					writer.write_capture(ch, tune, timestamp, x)
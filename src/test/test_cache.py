@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+
+from src.cache import ArrayCache
+from src.schemas.v1 import JsonDDCAndCalibratorV1
+from src.workflows.v1 import ModelSignalFactoryV1
+
+from test_synthetic import preset
+
+def test_cache(tmp_path):
+	cache = ArrayCache(str(tmp_path), max_bytes=3*8192*8 + 1000)
+
+	key = cache.key("test", 1)
+
+	assert cache.key("test", 1) == key
+	assert cache.key("test", 2) != key
+	assert cache.load(key) is None
+
+	cache.store(key, { "x": np.arange(8192.0), "y": np.array([1, 2]) })
+	arrays = cache.load(key)
+
+	assert isinstance(arrays["x"], np.memmap)
+	assert np.all(arrays["x"] == np.arange(8192.0))
+	assert np.all(arrays["y"] == [1, 2])
+
+	# Least recently used go first
+	keys = [cache.key("test", i) for i in range(2, 5)]
+
+	for i, other in enumerate(keys):
+		cache.store(other, { "x": np.zeros(8192) })
+		os.utime(tmp_path / other, (i + 10, i + 10))
+
+	os.utime(tmp_path / key, (100, 100))
+	cache.store(cache.key("test", 5), { "x": np.zeros(8192) })
+
+	assert cache.load(keys[0]) is None
+	assert cache.load(keys[1]) is None
+	assert cache.load(key) is not None
+
+def test_cached_models(tmp_path):
+	parsed = JsonDDCAndCalibratorV1.deserialize(preset["ddc-and-calibrator-v1"])
+
+	expected = [ModelSignalFactoryV1(parsed.ddc)(x) for x in parsed.signals]
+
+	for i in range(2):
+		factory = ModelSignalFactoryV1(parsed.ddc, cache=ArrayCache(str(tmp_path)))
+		signals = [factory(x) for x in parsed.signals]
+
+		for a, b in zip(signals, expected):
+			assert np.all(a.iq == b.iq)
+			assert np.all(a.est.weights == b.est.weights)
+			assert a.duration == b.duration
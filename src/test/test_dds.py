@@ -49,3 +49,55 @@ def test_sweep_energy_2():
 	y = dds.sweep(x, -frequency/2, +frequency/2, duration=pulse_duration, offset=.25/samplerate)
 
 	assert np.abs(y).sum() == samplerate*pulse_duration
+
+def test_psk():
+	samplerate = 5*1000*1000
+	samples = 8000
+	duration = samples/samplerate
+	code = [0, 0, 1, 0, 1]
+
+	x = dds.time_series(samplerate, duration)
+	y = dds.psk(x, 0, code)
+
+	assert np.allclose(y[:1600], 1)
+	assert np.allclose(y[3200:4800], -1)
+
+	codes = np.random.default_rng(0).integers(0, 2, [16, 40])
+	batch = dds.psk_batch(x, 1000, codes)
+
+	assert batch.shape == (16, samples)
+
+	for row, code in zip(batch, codes):
+		assert np.allclose(row, dds.psk(x, 1000, code))
+
+def test_ad9910_accumulator():
+	samples = 100000
+
+	for ftw, a, b in [(123456789, 0, 1), (2**32 - 5, 77, 1), (3000000000, 2**31 + 3, 3)]:
+		# Reference: FTW sequence of the ramp, accumulated cycle by cycle
+		m = np.arange(samples, dtype=np.uint64)
+		ftws = (np.uint64(ftw) + np.uint64(a) * (m // np.uint64(4*b))) & np.uint64(0xFFFFFFFF)
+
+		expected = np.zeros(samples, dtype=np.uint64)
+		expected[1:] = np.cumsum(ftws, dtype=np.uint64)[:-1]
+		expected &= np.uint64(0xFFFFFFFF)
+
+		acc = dds.ad9910_accumulator(m, ftw, a, b)
+
+		assert acc.dtype == np.uint32
+		assert np.array_equal(acc, expected.astype(np.uint32))
+
+		# Any cycle on its own, however far
+		assert dds.ad9910_accumulator([12345], ftw, a, b)[0] == acc[12345]
+
+def test_ad9910_nco():
+	sysclk = 1000*1000*1000
+	frequency = 1*1000*1000
+
+	x = dds.time_series(sysclk, 10/1000/1000)
+	ftw = round(frequency / sysclk * 2**32)
+
+	y = dds.ad9910_nco(x, ftw, pow=2**14)
+
+	# Within the phase resolution of the sine table
+	assert np.abs(y - 1j*np.exp(2j*np.pi*ftw/2**32*sysclk*x)).max() < 2*np.pi / 2**16
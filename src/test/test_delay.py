@@ -0,0 +1,109 @@
+import numpy as np
+
+from src import dds, delay
+
+samplerate = 5*1000*1000
+frames = 8192
+band = 500*1000
+
+def model():
+	x = dds.time_series(samplerate, frames/samplerate)
+	y = dds.sweep(x, -band/2, +band/2, 0, 900/1000/1000)
+
+	return y
+
+def shifted(signal, delays):
+	bins = np.fft.fftfreq(frames)
+	spectrum = np.fft.fft(signal)
+
+	return np.vstack([np.fft.ifft(spectrum * np.exp(-2j*np.pi*bins*d)) for d in delays])
+
+def test_spectral_batch():
+	m = model()
+	allow = np.abs(np.linspace(-samplerate/2, samplerate/2, frames)) < band*0.4
+	est = delay.SpectralDelayEstimator(m, allow)
+
+	delays = [0.0, 13.25, -40.5, 1000.75]
+	signals = shifted(m, delays) * 1000
+
+	batch = est.estimate_batch(signals)
+	single = np.array([est.estimate(x) for x in signals])
+
+	assert np.allclose(batch, single)
+	assert np.allclose(batch, delays, atol=0.01)
+
+def test_spectral_chunks():
+	m = model()
+	allow = np.abs(np.linspace(-samplerate/2, samplerate/2, frames)) < band*0.4
+	est = delay.SpectralDelayEstimator(m, allow)
+	est.chunk = 3
+
+	delays = [0.0, 13.25, -40.5, 1000.75, 2.5, -7.0, 300.0]
+	signals = shifted(m, delays) * 1000
+	int16 = np.stack([signals.real, signals.imag], axis=-1).round().astype(np.int16)
+
+	assert np.allclose(est.estimate_batch(signals), delays, atol=0.01)
+	assert np.allclose(est.estimate_batch(int16), delays, atol=0.01)
+
+	# Buffers stay a chunk long, one set per sample type
+	assert sorted([np.dtype(x).name for x in est.buffers]) == ["complex128", "complex64"]
+	assert all([x.shape[0] == 3 for buffers in est.buffers.values() for x in buffers])
+
+def test_spectral_v3_matches_v2():
+	m = model()
+	allow = np.abs(np.linspace(-samplerate/2, samplerate/2, frames)) < band*0.4
+	est = delay.SpectralDelayEstimator(m, allow)
+
+	rng = np.random.default_rng(0)
+	signals = shifted(m, [7.3, -250.1]) * 1000
+	signals += rng.standard_normal(signals.shape) * 100
+
+	for x in signals:
+		assert np.isclose(est.estimate(x), est.estimate_old_v2(x))
+
+def test_conv():
+	m = model()
+	est = delay.ConvDelayEstimator(m)
+
+	delays = [0.0, 13.0, -40.0, 1000.0, 12.4, -3.7]
+	signals = shifted(m, delays) * 1000
+
+	batch = est.estimate_batch(signals)
+	single = np.array([est.estimate(x) for x in signals])
+
+	assert np.allclose(batch, single)
+	assert np.allclose(batch[:4], delays[:4])
+	assert np.allclose(batch, delays, atol=0.5)
+
+def test_conv_pulse():
+	# A plain tone pulse, which SpectralDelayEstimator is not meant for
+	x = dds.time_series(samplerate, frames/samplerate)
+	m = dds.sine(x, 100*1000, duration=100/1000/1000)
+	est = delay.ConvDelayEstimator(m)
+
+	# As int16 real, imag pairs
+	signals = shifted(m, [250.0, 1024.0]) * 1000
+	signals = np.stack([signals.real, signals.imag], axis=-1).round().astype(np.int16)
+
+	assert np.allclose(est.estimate_batch(signals), [250.0, 1024.0], atol=0.5)
+
+def test_delay_in_freq_signed():
+	for n in [0, 3, -17]:
+		assert np.allclose(delay.delay_in_freq(n, frames), delay.delay_in_freq(n, frames, signed=True))
+
+def test_corrector():
+	m = model()
+	corrector = delay.DelayCorrector(frames)
+
+	delays = [0.0, 13.25, -40.5, 13.25]
+	signals = shifted(m, delays)
+	aligned = corrector.eliminate(signals, delays)
+
+	assert np.allclose(aligned, m[None, :])
+	assert len(corrector.twiddles) == 3
+
+def test_corrector_empty():
+	corrector = delay.DelayCorrector(frames)
+
+	assert corrector.eliminate(np.empty([0, frames], dtype=np.complex64), []).shape == (0, frames)
+	assert corrector.eliminate(np.empty([0, frames, 2], dtype=np.int16), []).shape == (0, frames)
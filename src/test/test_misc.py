@@ -12,3 +12,30 @@ def test_downsample():
 
 	assert np.all(l[0] < 2.5)
 	assert np.all(l[1] >= 2.5) and np.all(l[1] < 7.5)
+
+def test_bin_accumulator():
+	rng = np.random.default_rng(0)
+	edges = np.array([0, 10, 20, 30, 40])
+	acc = misc.BinAccumulator(edges)
+
+	x = rng.uniform(-5, 45, 500)
+	y = rng.standard_normal([3, 500])
+
+	# Same points folded in one batch at a time
+	acc.add(x, y[:2])
+	acc.add(x, y[2])
+
+	bins = np.digitize(x, edges) - 1
+
+	for i in range(len(edges) - 1):
+		ref = y[:, bins == i]
+
+		assert acc.count[i] == ref.size
+		assert np.isclose(acc.mean[i], np.mean(ref))
+		assert acc.min[i] == np.min(ref)
+		assert acc.max[i] == np.max(ref)
+
+	empty = misc.BinAccumulator(edges)
+	empty.add(x, y[:0])
+
+	assert np.all(np.isnan(empty.mean))
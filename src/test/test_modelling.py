@@ -0,0 +1,88 @@
+import json
+import os
+
+import numpy as np
+
+from src.delay import ConvDelayEstimator
+from src.misc import BinAccumulator, frequency_bins, parse_freq_expr
+from src.session import stream_session
+from src.synthetic import synthesize_session
+from src.schemas.v1 import JsonDDCAndCalibratorV1
+from src.workflows import load_models
+from src.workflows.v1 import ModelSignalV1, ModelSignalFactoryV1
+from src.workflows.v2 import ModelSignalV2
+
+from test_synthetic import preset
+
+def test_factory():
+	parsed = JsonDDCAndCalibratorV1.deserialize(preset["ddc-and-calibrator-v1"])
+	factory = ModelSignalFactoryV1(parsed.ddc)
+
+	a, b = [factory(descriptor) for descriptor in parsed.signals]
+
+	# Sweeps differing only in tune share the baseband
+	assert len(factory.basebands) == 1
+	assert a.est is b.est
+	assert a.time is b.time
+
+	for signal, descriptor in zip([a, b], parsed.signals):
+		other = ModelSignalV1(descriptor, parsed.ddc)
+
+		assert np.allclose(signal.iq, other.iq)
+		assert signal.duration == other.duration
+
+def test_model_v2():
+	with open(os.path.join(os.path.dirname(__file__), "../../presets/standard_sounding_pulse.json")) as f:
+		obj = json.load(f)
+
+	preset, (signal,) = load_models(obj)
+
+	assert isinstance(signal, ModelSignalV2)
+	assert isinstance(signal.est, ConvDelayEstimator)
+	assert np.isclose(signal.duration, 900e-6)
+
+	# 5 MHz: chips at 700, 820, 860 us, nothing past 900 us
+	body = np.abs(signal.iq[:4500])
+
+	assert np.all(body > 0)
+	assert np.all(signal.iq[4500:] == 0)
+
+	# 180 deg steps at chip boundaries of the 154 MHz chips
+	assert np.isclose(np.angle(signal.iq[4100] * signal.iq[4099].conj(), deg=True) % 360, 180, atol=0.1)
+	assert np.isclose(np.angle(signal.iq[4101] * signal.iq[4100].conj(), deg=True), 0, atol=0.1)
+
+	shifted = np.roll(signal.iq, 37)
+	assert np.isclose(signal.eliminate_delay(shifted), signal.iq).all()
+
+def test_model_v2_binning(tmp_path):
+	with open(os.path.join(os.path.dirname(__file__), "../../presets/standard_sounding_pulse.json")) as f:
+		obj = json.load(f)
+
+	location = str(tmp_path / "session")
+	synthesize_session(location, obj, channels=(1,), repeats=2, delay=20e-6, seed=0)
+
+	# Pooled as amplitude_response.py does
+	preset, (signal,) = load_models(obj)
+	tune = parse_freq_expr(signal.descriptor.tune)
+	crop = (signal.time >= signal.duration*0.05) * (signal.time < signal.duration*0.95)
+	x = signal.temporal_freq[crop] + tune
+
+	edges, rows, centers = frequency_bins(x, 10000)
+	acc = BinAccumulator(edges)
+
+	for batch in stream_session(location):
+		iq = batch.iq[batch.center_freq == tune]
+		acc.add(x, np.abs(signal.eliminate_delay_batch(iq)[:, crop]))
+
+	# One bin per chip frequency, labelled by it, none of the points dropped
+	assert list(centers) == [154e6, 158e6]
+	assert acc.count.sum() == 2 * crop.sum()
+	assert np.allclose(acc.mean[rows], [np.abs(signal.iq[4200]), np.abs(signal.iq[1000])], rtol=1e-3)
+
+	# A sweep keeps its contiguous grid, bins between the rounded points
+	sweep = np.linspace(154e6, 155e6, 849)
+	edges, rows, centers = frequency_bins(sweep, 10000)
+
+	assert len(edges) == 101
+	assert list(rows) == list(range(100))
+	assert np.allclose(centers, edges[1:] - 5000)
@@ -0,0 +1,190 @@
+import threading
+import struct
+import time
+
+import numpy as np
+
+from src import orda, misc
+
+def block(type, payload):
+	return struct.pack("<4sBI", b"ORDA", type, len(payload)) + payload
+
+def superheader(pairs):
+	return b"".join([struct.pack("<HH", k, v) for k, v in pairs.items()])
+
+def make_file(path, channels=(1, 3), repeats=3, samples=16):
+	chunks = [block(3, superheader({30: 5000, 3: samples}))]
+	expected = []
+
+	for i in range(repeats):
+		for ch in channels:
+			local = {
+				7: ch,
+				9: 2025, 10: 7*256 + 9, 11: 21*256 + 7, 12: 28, 13: i,
+				16: 154000 % 65536, 17: 154000 // 65536
+			}
+
+			real = np.arange(samples, dtype=np.int16) + i
+			imag = -np.arange(samples, dtype=np.int16) * ch
+
+			chunks.append(block(1, superheader(local)))
+			chunks.append(block(2, imag.tobytes() + real.tobytes()))
+			expected.append((i, ch, real + 1j*imag))
+
+	with open(path, "wb") as f:
+		f.write(b"".join(chunks))
+
+	return expected
+
+def test_stream_vs_mapped(tmp_path):
+	path = tmp_path / "test.ISE"
+	expected = make_file(path)
+
+	with open(path, "rb") as f:
+		a = orda.StreamORDA(f).all_captures()
+
+	with open(path, "rb") as f:
+		b = orda.MappedORDA(f).all_captures()
+
+	assert len(a) == len(b) == len(expected)
+
+	for u, v, (trig, ch, iq) in zip(a, b, expected):
+		assert u.trigger_number == v.trigger_number == trig
+		assert u.channel_number == v.channel_number == ch
+		assert u.center_freq == v.center_freq == 154*1000*1000
+		assert u.samplerate == v.samplerate == 5*1000*1000
+		assert u.timestamp == v.timestamp
+		assert np.all(u.iq == iq)
+		assert np.all(v.iq == iq)
+
+def test_mapped_empty(tmp_path):
+	path = tmp_path / "empty.ISE"
+	path.write_bytes(b"")
+
+	with open(path, "rb") as f:
+		assert orda.MappedORDA(f).all_captures() == []
+
+def test_index(tmp_path):
+	path = tmp_path / "test.ISE"
+	expected = make_file(path)
+
+	index = orda.load_orda_index(str(path))
+
+	assert len(index) == len(expected)
+	assert list(index["trigger"]) == [x[0] for x in expected]
+	assert list(index["channel"]) == [x[1] for x in expected]
+	assert np.all(index["center_freq"] == 154*1000*1000)
+
+	# Second call is served from the sidecar
+	assert (tmp_path / "test.ISE.idx.npz").exists()
+	assert np.array_equal(orda.load_orda_index(str(path)), index)
+
+	with open(path, "rb") as f:
+		stream = orda.MappedORDA(f)
+		captures = stream.all_captures()
+
+		for row, capture in zip(index, captures):
+			other = stream.capture_at(row)
+
+			assert other.timestamp == capture.timestamp
+			assert other.trigger_number == capture.trigger_number
+			assert np.all(other.iq == capture.iq)
+
+def test_lazy_iq(tmp_path):
+	path = tmp_path / "test.ISE"
+	expected = make_file(path)
+
+	with open(path, "rb") as f:
+		captures = orda.MappedORDA(f).all_captures()
+
+	for capture, (trig, ch, iq) in zip(captures, expected):
+		assert capture._iq is None
+		assert capture.raw.dtype == np.int16
+		assert np.all(capture.raw[1] == iq.real)
+		assert np.all(capture.raw[0] == iq.imag)
+
+		assert np.all(capture.iq == iq)
+		assert capture.iq is capture.iq
+
+def test_dtype(tmp_path):
+	path = tmp_path / "test.ISE"
+	expected = make_file(path)
+
+	for dtype in [np.complex64, np.int16]:
+		with open(path, "rb") as f:
+			captures = orda.MappedORDA(f, dtype=dtype).all_captures()
+
+		for capture, (trig, ch, iq) in zip(captures, expected):
+			assert capture.iq.dtype == dtype
+			assert np.all(misc.as_complex(capture.iq) == iq)
+
+def test_batches(tmp_path):
+	path = tmp_path / "test.ISE"
+	expected = make_file(path, repeats=5)
+
+	with open(path, "rb") as f:
+		batches = list(orda.MappedORDA(f, dtype=np.complex64).batches(4))
+
+	assert [len(x) for x in batches] == [4, 4, 2]
+
+	iq = np.vstack([x.iq for x in batches])
+	channels = np.hstack([x.channel_number for x in batches])
+	triggers = np.hstack([x.trigger_number for x in batches])
+
+	assert iq.dtype == np.complex64
+	assert np.all(iq == np.vstack([x[2] for x in expected]))
+	assert list(channels) == [x[1] for x in expected]
+	assert list(triggers) == [x[0] for x in expected]
+	assert np.all(batches[0].center_freq == 154*1000*1000)
+
+def test_follow(tmp_path):
+	path = tmp_path / "test.ISE"
+	expected = make_file(path)
+	data = path.read_bytes()
+
+	# Cut mid-block, as if the DDC was still writing
+	cut = len(data) // 2 + 3
+	path.write_bytes(data[:cut])
+
+	def writer():
+		time.sleep(0.2)
+
+		with open(path, "ab") as f:
+			f.write(data[cut:])
+
+	thread = threading.Thread(target=writer)
+	thread.start()
+
+	with open(path, "rb") as f:
+		captures = orda.StreamORDA(f, follow=0.5, poll=0.05).all_captures()
+
+	thread.join()
+
+	assert [x.trigger_number for x in captures] == [x[0] for x in expected]
+	assert np.all(captures[-1].iq == expected[-1][2])
+
+def test_follow_gives_up(tmp_path):
+	path = tmp_path / "test.ISE"
+	expected = make_file(path)
+	path.write_bytes(path.read_bytes()[:-5])
+
+	with open(path, "rb") as f:
+		captures = orda.StreamORDA(f, follow=0.1, poll=0.05).all_captures()
+
+	assert len(captures) == len(expected) - 1
+
+def test_writer(tmp_path):
+	path = tmp_path / "test.ISE"
+	expected = make_file(path, samples=32)
+
+	with open(path, "rb") as f:
+		captures = orda.StreamORDA(f).all_captures()
+
+	with open(tmp_path / "copy.ISE", "wb") as f:
+		writer = orda.ORDAWriter(f)
+		writer.write_global_header(5*1000*1000, 32)
+
+		for capture in captures:
+			writer.write_capture(capture.channel_number, capture.center_freq, capture.timestamp, capture.iq)
+
+	assert (tmp_path / "copy.ISE").read_bytes() == path.read_bytes()
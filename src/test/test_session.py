@@ -0,0 +1,123 @@
+from datetime import datetime, timezone
+
+import numpy as np
+
+from src import session
+from test_orda import make_file
+
+def test_capture_set(tmp_path):
+	a = make_file(tmp_path / "000.ISE", repeats=2)
+	b = make_file(tmp_path / "001.ISE", repeats=3)
+
+	captures = session.CaptureSet(str(tmp_path))
+
+	assert len(captures) == len(a) + len(b)
+	assert captures.channels == {1, 3}
+
+	# Trigger numbers carry over between files
+	ch1 = captures.select(channel=1, center_freq=154*1000*1000)
+
+	assert list(ch1.trigger_number) == [0, 1, 2, 3, 4]
+	assert list(captures.select(channel=3, triggers=range(1, 3)).trigger_number) == [1, 2]
+
+	iq = ch1.iq()
+	expected = [x[2] for x in a + b if x[1] == 1]
+
+	assert iq.shape == (5, 16)
+	assert np.all(iq == np.vstack(expected))
+
+	# Local header timestamp is 2025-07-09 07:21:28 + i ms
+	since = datetime(2025, 7, 9, 7, 21, 28, 1000, tzinfo=timezone.utc)
+
+	assert len(captures.select(channel=1, since=since)) == 3
+	assert len(captures.select(channel=1, until=since)) == 2
+	assert len(captures.select(center_freq=0)) == 0
+
+	# Empty selections keep the capture length
+	assert captures.select(center_freq=0).iq().shape == (0, 16)
+	assert captures.select(center_freq=0).raw().shape == (0, 2, 16)
+
+def test_load_session(tmp_path):
+	expected = []
+
+	for i in range(4):
+		expected += make_file(tmp_path / f"{i:03}.ISE", repeats=i + 1)
+
+	serial = session.load_session(str(tmp_path), dtype=np.complex64, workers=1)
+	parallel = session.load_session(str(tmp_path), dtype=np.complex64, workers=4)
+
+	assert len(serial) == len(parallel) == len(expected)
+	assert np.all(serial.iq == np.vstack([x[2] for x in expected]))
+	assert np.all(serial.iq == parallel.iq)
+	assert np.all(serial.trigger_number == parallel.trigger_number)
+	assert list(serial.trigger_number[serial.channel_number == 3]) == list(range(10))
+
+def test_follow_session(tmp_path):
+	a = make_file(tmp_path / "000.ISE", repeats=2)
+	b = make_file(tmp_path / "001.ISE", repeats=3)
+
+	captures = list(session.follow_session(str(tmp_path), idle=0.2, poll=0.05))
+
+	assert len(captures) == len(a) + len(b)
+	assert [x.trigger_number for x in captures if x.channel_number == 1] == [0, 1, 2, 3, 4]
+
+def test_follow_batches(tmp_path):
+	make_file(tmp_path / "000.ISE", repeats=2)
+	make_file(tmp_path / "001.ISE", repeats=3)
+
+	expected = session.load_session(str(tmp_path))
+	batches = list(session.follow_batches(str(tmp_path), interval=0.0, idle=0.2, poll=0.05))
+
+	assert sum([len(x) for x in batches]) == len(expected)
+	assert np.all(np.vstack([x.iq for x in batches]) == expected.iq)
+	assert np.all(np.hstack([x.trigger_number for x in batches]) == expected.trigger_number)
+	assert np.all(np.hstack([x.timestamp for x in batches]) == expected.timestamp)
+
+def test_archive(tmp_path):
+	location = tmp_path / "session"
+	location.mkdir()
+	(location / "preset.json").write_text("{}")
+
+	make_file(location / "000.ISE", repeats=2)
+	make_file(location / "001.ISE", repeats=3)
+
+	session.convert_session(str(location), str(tmp_path / "archive"))
+
+	a = session.CaptureSet(str(location))
+	b = session.CaptureSet(str(tmp_path / "archive"))
+
+	assert (tmp_path / "archive" / "preset.json").read_text() == "{}"
+	assert len(a) == len(b)
+	assert np.all(a.trigger_number == b.trigger_number)
+	assert np.all(a.iq() == b.iq())
+
+	u = a.select(channel=3, triggers=range(1, 4))
+	v = b.select(channel=3, triggers=range(1, 4))
+
+	assert np.all(u.iq(np.complex64) == v.iq(np.complex64))
+	assert [x.timestamp for x in u.captures] == [x.timestamp for x in v.captures]
+	assert all([np.all(x.iq == y.iq) for x, y in zip(u.captures, v.captures)])
+	assert a.select(channel=2).iq().shape == b.select(channel=2).iq().shape == (0, 16)
+
+def test_stream_session(tmp_path):
+	location = tmp_path / "session"
+	location.mkdir()
+	(location / "preset.json").write_text("{}")
+
+	a = make_file(location / "000.ISE", repeats=2)
+	b = make_file(location / "001.ISE", repeats=3)
+
+	session.convert_session(str(location), str(tmp_path / "archive"))
+
+	for path in [location, tmp_path / "archive"]:
+		batches = list(session.stream_session(str(path), n=3))
+
+		assert max([len(x) for x in batches]) == 3
+		assert sum([len(x) for x in batches]) == len(a) + len(b)
+
+		iq = np.vstack([x.iq for x in batches])
+		triggers = np.hstack([x.trigger_number for x in batches])
+		channels = np.hstack([x.channel_number for x in batches])
+
+		assert np.all(iq == np.vstack([x[2] for x in a + b]))
+		assert list(triggers[channels == 1]) == [0, 1, 2, 3, 4]
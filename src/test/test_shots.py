@@ -0,0 +1,66 @@
+import pytest
+import numpy as np
+
+from src import session
+from src.shots import ShotAssembler
+from test_orda import make_file
+
+def test_shots(tmp_path):
+	a = make_file(tmp_path / "000.ISE", repeats=3)
+	b = make_file(tmp_path / "001.ISE", repeats=2)
+	expected = a + b
+
+	tunes = [154*1000*1000, 154*1000*1000]
+
+	for batches in [session.stream_session(str(tmp_path), n=3), session.CaptureSet(str(tmp_path)).batches(4)]:
+		assembler = ShotAssembler(tunes)
+		shots = list(assembler.batches(batches))
+
+		assert assembler.channels == [1, 3]
+		assert assembler.shot_idx == 5
+
+		shot_idx = np.hstack([x[1] for x in shots])
+		signal_idx = np.hstack([[x[0]]*len(x[1]) for x in shots])
+		iq = np.vstack([x[2] for x in shots])[np.argsort(shot_idx)]
+
+		assert sorted(shot_idx) == list(range(5))
+		assert np.all(signal_idx == shot_idx % 2)
+		assert iq.shape == (5, 2, 16)
+		assert np.all(iq[:, 0] == np.vstack([x[2] for x in expected if x[1] == 1]))
+		assert np.all(iq[:, 1] == np.vstack([x[2] for x in expected if x[1] == 3]))
+
+def test_shots_validation():
+	iq = np.zeros(16)
+	tune = 154*1000*1000
+
+	# Missing channel
+	assembler = ShotAssembler([tune], channels=[1, 3])
+	assembler.add(1, tune, iq)
+
+	with pytest.raises(AssertionError):
+		assembler.add(1, tune, iq)
+
+	# Extra channel
+	assembler = ShotAssembler([tune])
+	assembler.add(1, tune, iq)
+	assembler.add(3, tune, iq)
+	assembler.add(1, tune, iq)
+
+	with pytest.raises(AssertionError):
+		assembler.add(2, tune, iq)
+
+	# Truncated last shot
+	assembler = ShotAssembler([tune], channels=[1, 3])
+	assembler.add(1, tune, iq)
+
+	with pytest.raises(AssertionError):
+		assembler.close()
+
+	# 0 Hz is skipped, wrong tune is not
+	assembler = ShotAssembler([tune], channels=[1])
+
+	assert assembler.add(1, 0, iq) == []
+	assert assembler.add(1, tune, iq)[0][:2] == (0, 0)
+
+	with pytest.raises(AssertionError):
+		assembler.add(1, tune + 1, iq)
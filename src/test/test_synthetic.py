@@ -0,0 +1,36 @@
+import numpy as np
+
+from src import session, synthetic
+from src.schemas.v1 import JsonDDCAndCalibratorV1
+from src.workflows.v1 import ModelSignalV1
+
+preset = { "ddc-and-calibrator-v1": {
+	"ddc": { "config_dir": "c:/workprogs/active/", "samplerate": "5 MHz", "frames": 8192 },
+	"signals": [
+		{ "tune": "154 MHz", "level": "60 mV", "emit": "sweep 0 us 900 us 154 MHz 77 1" },
+		{ "tune": "155 MHz", "level": "60 mV", "emit": "sweep 0 us 900 us 155 MHz 77 1" }
+	]
+} }
+
+def test_synthesize_session(tmp_path):
+	location = str(tmp_path / "session")
+
+	synthetic.synthesize_session(location, preset, channels=(1, 3), repeats=3, files=2, delay=100e-6, phase_offset={3: 90.0}, seed=0)
+
+	captures = session.CaptureSet(location)
+	captures = captures[captures.center_freq != 0]
+
+	assert len(captures) == 2 * 3 * 2
+	assert captures.channels == {1, 3}
+
+	parsed = JsonDDCAndCalibratorV1.deserialize(preset["ddc-and-calibrator-v1"])
+	signal = ModelSignalV1(parsed.signals[1], parsed.ddc)
+
+	u = captures.select(channel=1, center_freq=155*1000*1000).iq()
+	v = captures.select(channel=3, center_freq=155*1000*1000).iq()
+
+	assert u.shape == (3, 8192)
+
+	for x, y in zip(u, v):
+		assert np.abs(signal.est.estimate(x) - 500) < 0.1
+		assert np.abs(np.angle(np.sum(y * x.conj()), deg=True) - 90) < 0.1
@@ -0,0 +1,31 @@
+from src.schemas.v1 import JsonDDCAndCalibratorV1
+from src.schemas.v2 import JsonDDCAndCalibratorV2
+
+from .v1 import ModelSignalFactoryV1
+from .v2 import ModelSignalV2
+
+def load_models(obj, cache=None):
+	"""
+	Model the signals of a preset object, whatever version it is
+
+	obj	preset as loaded from json, e.g. {"ddc-and-calibrator-v1": {...}}
+	cache	an ArrayCache for the V1 models, see src/cache.py
+
+	Returns (preset, signals)
+	"""
+
+	assert len(obj) == 1, "Malformed preset"
+
+	if "ddc-and-calibrator-v1" in obj:
+		preset = JsonDDCAndCalibratorV1.deserialize(obj["ddc-and-calibrator-v1"])
+		factory = ModelSignalFactoryV1(preset.ddc, cache=cache)
+
+		return preset, [factory(descriptor) for descriptor in preset.signals]
+
+	if "ddc-and-calibrator-v2" in obj:
+		# Built in one vectorized pass each, not worth caching
+		preset = JsonDDCAndCalibratorV2.deserialize(obj["ddc-and-calibrator-v2"])
+
+		return preset, [ModelSignalV2(descriptor, preset.ddc) for descriptor in preset.signals]
+
+	assert 0, "Unknown preset version"
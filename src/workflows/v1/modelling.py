@@ -1,8 +1,8 @@
 
 import numpy as np
 
-from src.delay import SpectralDelayEstimator
-from src.misc import ad9910_sweep_bandwidth, ad9910_best_asf_fsc_v1, ad9910_vrms_v1, ad9910_inv_sinc, parse_freq_expr, parse_volt_expr, parse_time_expr, ddc_cost_mv
+from src.delay import SpectralDelayEstimator, DelayCorrector
+from src.misc import ad9910_sweep_bandwidth, ad9910_best_asf_fsc_v1, ad9910_vrms_v1, ad9910_inv_sinc, parse_freq_expr, parse_volt_expr, parse_time_expr, ddc_cost_mv, as_complex
 import src.dds as dds
 
 #
@@ -22,13 +22,112 @@ import src.dds as dds
 # the application demands
 #
 # Who makes SignalV1?
+# - ModelSignalFactoryV1, when there are many of them
 #
 
+class ModelSweepV1:
+	"""
+	Baseband half of a sweep model: everything that does not depend on the tune or level
+
+	- Time and frequency axes
+	- Unit amplitude sweep
+	- Delay estimator
+
+	Signals of a frequency sweep preset differ only in tune, so they can all share one
+	"""
+
+	def __init__(self, ddc, delay, duration, a, b, trim=0.05):
+		sysclk = parse_freq_expr("1 GHz")
+
+		rate = parse_freq_expr(ddc.samplerate)
+		frames = ddc.frames
+
+		capture_duration = frames / rate
+
+		#
+		# Prepare model signal
+		# TODO: support off-center tuning
+		#
+		time = dds.time_series(rate, capture_duration)
+		band = ad9910_sweep_bandwidth(a, b, sysclk=sysclk)
+
+		temporal_freq = (time / duration)*band - band/2
+		spectral_freq = np.linspace(-rate/2, rate/2, frames)
+		model_sweep = dds.sweep(time, -band/2, band/2, 0, duration)
+
+		#
+		# Prepare delay estimator
+		#
+		# We could have some kind of heuristic to decide on the estimator,
+		# for example having at least 100 bins occupied to pick SpectralDelayEstimator:
+		# bins_occupied = int( torch.unique(freqs - freqs % (rate/frames)).shape[0] )
+		#
+		# But lets have it simpler:
+		# - Sweeps have SpectralDelayEstimator - which assumes contiguous indices_est
+		# - Pulses have ConvDelayEstimator
+		#
+		# The estimator works off the unit amplitude sweep:
+		# the amplitude shaping is smooth and barely changes the spectral weights,
+		# while phase, which the estimate comes from, is not affected at all
+
+		# Establish the frequencies at truncated head/tail
+		start = duration*trim
+		stop = duration*(1-trim)
+
+		temporal_indices = (time >= start) * (time < stop)
+
+		min_freq = temporal_freq[temporal_indices].min()
+		max_freq = temporal_freq[temporal_indices].max()
+
+		indices_est = (spectral_freq >= min_freq)*(spectral_freq < max_freq)
+		est = SpectralDelayEstimator(model_sweep, indices_est)
+
+		self.iq = model_sweep
+		self.est = est
+		self.time = time
+		self.delay = delay
+		self.duration = duration
+		self.temporal_freq = temporal_freq
+		self.spectral_freq = spectral_freq
+
+	def state(self):
+		"""
+		Arrays to rebuild this object from, see from_state()
+		"""
+
+		return {
+			"iq": self.iq,
+			"time": self.time,
+			"temporal_freq": self.temporal_freq,
+			"spectral_freq": self.spectral_freq,
+			"spectrum_m": self.est.spectrum_m,
+			"indices_allow": self.est.indices_allow,
+			"timing": np.array([self.delay, self.duration])
+		}
+
+	@classmethod
+	def from_state(cls, state):
+		"""
+		Rebuild from state(), e.g. as loaded from src/cache.py
+		"""
+
+		self = cls.__new__(cls)
+		self.iq = state["iq"]
+		self.est = SpectralDelayEstimator.from_spectrum(state["spectrum_m"], state["indices_allow"])
+		self.time = state["time"]
+		self.delay = float(state["timing"][0])
+		self.duration = float(state["timing"][1])
+		self.temporal_freq = state["temporal_freq"]
+		self.spectral_freq = state["spectral_freq"]
+
+		return self
+
 class ModelSignalV1:
 	"""
 	Joint DDC + Calibrator signal modelling application class
 
-	Self-contained and context-independent
+	Self-contained and context-independent;
+	see ModelSignalFactoryV1 to share work between signals
 	"""
 
 	# Models have associated DDC settings and the signal descriptor
@@ -37,6 +136,7 @@ class ModelSignalV1:
 
 	# Lack of context regarding other signals can cause duplicate work-
 	# most signals are literally the same
+	# (unless they come from ModelSignalFactoryV1, which shares est and the axes)
 	iq = None
 	est = None
 	time = None
@@ -45,6 +145,11 @@ class ModelSignalV1:
 	temporal_freq = None
 	spectral_freq = None
 
+	# Delay correction only depends on the capture length
+	# so a corrector (and its twiddle cache) is shared by signals of the same length
+	correctors = {}
+	corrector = None
+
 	# The calibrator's signal level calibration value
 	# Adjusts how much voltage is demanded at AD9910s
 	# DAC output to factor in losses in the lowpass filter
@@ -53,12 +158,14 @@ class ModelSignalV1:
 	# For now left at 1
 	signal_level_factor = 1.0
 
-	def __init__(self, descriptor, ddc, trim=0.05):
+	def __init__(self, descriptor, ddc, trim=0.05, baseband=None, iq=None):
 		"""
 		Prepares a model signal as DDC would see it
 
-		trim	Portion of pulse head+tail to be discarded so as to remove transients
-			Default: 0.05
+		trim		Portion of pulse head+tail to be discarded so as to remove transients
+				Default: 0.05
+		baseband	A ModelSweepV1 matching the descriptor, to skip preparing one
+		iq		The model I/Q made earlier for the same descriptor, to skip the amplitude shaping
 		"""
 
 		self.ddc = ddc
@@ -66,74 +173,46 @@ class ModelSignalV1:
 
 		sysclk = parse_freq_expr("1 GHz")
 
-		rate = parse_freq_expr(ddc.samplerate)
-		frames = ddc.frames
-
-		capture_duration = frames / rate
-
-		# FIXME: we should just be able to use the level directly if the signal generator really was properly calibrated
-		# As of now it isn't
-		level = parse_volt_expr(descriptor.level) * self.signal_level_factor
-		asf, fsc = ad9910_best_asf_fsc_v1(level)
-		level = ad9910_vrms_v1(asf, fsc) / self.signal_level_factor
-
 		tokens = descriptor.emit.split(" ")
 
 		if tokens[0] == "sweep":
 			sweep, offset, offset_unit, duration, duration_unit, freq, freq_unit, a, b = tokens
 
-			delay = parse_time_expr(f"{offset} {offset_unit}")
-			duration = parse_time_expr(f"{duration} {duration_unit}")
 			center_frequency = parse_freq_expr(f"{freq} {freq_unit}")
-			a = int(a)
-			b = int(b)
-
-			#
-			# Prepare model signal
-			# TODO: support off-center tuning
-			#
-			time = dds.time_series(rate, capture_duration)
-			band = ad9910_sweep_bandwidth(a, b, sysclk=sysclk)
-
-			temporal_freq = (time / duration)*band - band/2
-			spectral_freq = np.linspace(-rate/2, rate/2, frames)
-			model_sweep = dds.sweep(time, -band/2, band/2, 0, duration)
-
-			# DDC's perceived signal level
-			amplitude = level * 1000 / ddc_cost_mv(temporal_freq + center_frequency)
-			amplitude /= ad9910_inv_sinc(temporal_freq + center_frequency, sysclk=sysclk)
-			model_sweep *= amplitude
-
-			#
-			# Prepare delay estimator
-			#
-			# We could have some kind of heuristic to decide on the estimator,
-			# for example having at least 100 bins occupied to pick SpectralDelayEstimator:
-			# bins_occupied = int( torch.unique(freqs - freqs % (rate/frames)).shape[0] )
-			#
-			# But lets have it simpler:
-			# - Sweeps have SpectralDelayEstimator - which assumes contiguous indices_est
-			# - Pulses have ConvDelayEstimator
-
-			# Establish the frequencies at truncated head/tail
-			start = duration*trim
-			stop = duration*(1-trim)
-
-			temporal_indices = (time >= start) * (time < stop)
-
-			min_freq = temporal_freq[temporal_indices].min()
-			max_freq = temporal_freq[temporal_indices].max()
-
-			indices_est = (spectral_freq >= min_freq)*(spectral_freq < max_freq)
-			est = SpectralDelayEstimator(model_sweep, indices_est)
-
-			self.iq = model_sweep
-			self.est = est
-			self.time = time
-			self.delay = delay
-			self.duration = duration
+
+			if baseband is None:
+				baseband = ModelSweepV1(
+					ddc,
+					parse_time_expr(f"{offset} {offset_unit}"),
+					parse_time_expr(f"{duration} {duration_unit}"),
+					int(a),
+					int(b),
+					trim=trim
+				)
+
+			temporal_freq = baseband.temporal_freq
+
+			if iq is None:
+				# FIXME: we should just be able to use the level directly if the signal generator really was properly calibrated
+				# As of now it isn't
+				level = parse_volt_expr(descriptor.level) * self.signal_level_factor
+				asf, fsc = ad9910_best_asf_fsc_v1(level)
+				level = ad9910_vrms_v1(asf, fsc) / self.signal_level_factor
+
+				# DDC's perceived signal level
+				amplitude = level * 1000 / ddc_cost_mv(temporal_freq + center_frequency)
+				amplitude /= ad9910_inv_sinc(temporal_freq + center_frequency, sysclk=sysclk)
+
+				iq = baseband.iq * amplitude
+
+			self.iq = iq
+			self.est = baseband.est
+			self.corrector = self.correctors.setdefault(ddc.frames, DelayCorrector(ddc.frames))
+			self.time = baseband.time
+			self.delay = baseband.delay
+			self.duration = baseband.duration
 			self.temporal_freq = temporal_freq
-			self.spectral_freq = spectral_freq
+			self.spectral_freq = baseband.spectral_freq
 		else:
 			assert 0
 
@@ -141,9 +220,107 @@ class ModelSignalV1:
 		"""
 		Remove time delay from a capture
 
+		Takes any capture sample type
+
 		TODO: shoud this actually be "fit()"?
 		"""
-		sample_delay = self.est.estimate(iq)
 
-		# Use simple roll for now
-		return np.roll( iq, round(-sample_delay.item()) )
+		return self.eliminate_delay_batch( as_complex(iq)[None] )[0]
+
+	def eliminate_delay_batch(self, iq):
+		"""
+		Remove time delay from a stack of captures, e.g. a repeat group
+
+		Delays are estimated for every row and removed with sub-sample accuracy
+		"""
+
+		iq = as_complex(iq)
+		sample_delay = self.est.estimate_batch(iq)
+
+		return self.corrector.eliminate(iq, sample_delay)
+
+class ModelSignalFactoryV1:
+	"""
+	Makes ModelSignalV1 objects for one DDC setup, sharing work between them
+
+	Signals that differ only in tune (and level) share the ModelSweepV1:
+	the sweep, the axes and the delay estimator. Only the amplitude shaping,
+	which depends on frequency, is done per signal
+
+	With a cache (see src/cache.py) both halves persist across runs:
+	basebands keyed by the sweep and DDC settings, model I/Q by the descriptor and DDC settings
+
+	Example:
+
+	```
+	factory = ModelSignalFactoryV1(preset.ddc, cache=ArrayCache())
+	signals = [factory(descriptor) for descriptor in preset.signals]
+	```
+	"""
+
+	def __init__(self, ddc, trim=0.05, cache=None):
+		self.ddc = ddc
+		self.trim = trim
+		self.cache = cache
+		self.basebands = {}
+
+	def baseband(self, descriptor):
+		"""
+		ModelSweepV1 for a descriptor, made once per distinct sweep
+		"""
+
+		tokens = descriptor.emit.split(" ")
+
+		assert tokens[0] == "sweep"
+
+		sweep, offset, offset_unit, duration, duration_unit, freq, freq_unit, a, b = tokens
+
+		delay = parse_time_expr(f"{offset} {offset_unit}")
+		duration = parse_time_expr(f"{duration} {duration_unit}")
+		key = (delay, duration, int(a), int(b))
+
+		if key in self.basebands:
+			return self.basebands[key]
+
+		if self.cache is None:
+			baseband = ModelSweepV1(self.ddc, *key, trim=self.trim)
+		else:
+			digest = self.cache.key("ModelSweepV1", self.ddc.samplerate, self.ddc.frames, self.trim, *key)
+			state = self.cache.load(digest)
+
+			if state is None:
+				baseband = ModelSweepV1(self.ddc, *key, trim=self.trim)
+				self.cache.store(digest, baseband.state())
+			else:
+				baseband = ModelSweepV1.from_state(state)
+
+		self.basebands[key] = baseband
+
+		return baseband
+
+	def __call__(self, descriptor):
+		baseband = self.baseband(descriptor)
+
+		if self.cache is None:
+			return ModelSignalV1(descriptor, self.ddc, trim=self.trim, baseband=baseband)
+
+		digest = self.cache.key(
+			"ModelSignalV1",
+			self.ddc.samplerate,
+			self.ddc.frames,
+			self.trim,
+			descriptor.tune,
+			descriptor.level,
+			descriptor.emit,
+			ModelSignalV1.signal_level_factor
+		)
+
+		state = self.cache.load(digest)
+
+		if state is None:
+			signal = ModelSignalV1(descriptor, self.ddc, trim=self.trim, baseband=baseband)
+			self.cache.store(digest, { "iq": signal.iq })
+		else:
+			signal = ModelSignalV1(descriptor, self.ddc, trim=self.trim, baseband=baseband, iq=state["iq"])
+
+		return signal
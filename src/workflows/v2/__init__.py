@@ -0,0 +1 @@
+from .modelling import *
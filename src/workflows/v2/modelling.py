@@ -0,0 +1,130 @@
+import numpy as np
+
+from src.delay import SpectralDelayEstimator, ConvDelayEstimator, DelayCorrector
+from src.misc import ad9910_best_asf_fsc_v1, ad9910_vrms_v1, ad9910_inv_sinc, parse_freq_expr, parse_volt_expr, parse_time_expr, parse_angle_expr, ddc_cost_mv
+from src.workflows.v1 import ModelSignalV1
+import src.dds as dds
+
+#
+# Application classes for the V2 preset format:
+# - ModelSignalV2	A self-contained DDC capture model of a chip sequence
+#
+# See PresetInterpreterDDCAndCalibratorV2 for what the calibrator is told to do
+#
+
+class ModelSignalV2(ModelSignalV1):
+	"""
+	Joint DDC + Calibrator signal modelling application class, for chip sequences
+
+	A signal is a sequence of chips, each an AD9910 profile held for some time:
+	- hold		how long
+	- amplitude	ASF
+	- frequency	FTW
+	- phase		POW, added to the output of the phase accumulator
+
+	The phase accumulator keeps running across profile switches,
+	so phase is continuous at chip boundaries apart from the POW steps
+
+	The whole sequence is modelled in one pass: every sample looks its chip up
+	in the cumulative hold times
+
+	Delay elimination is the same as in ModelSignalV1
+	"""
+
+	# ModelSignalV1's heuristic for picking the delay estimator:
+	# SpectralDelayEstimator wants at least this many bins occupied, otherwise ConvDelayEstimator is used
+	min_spectral_bins = 100
+
+	def __init__(self, descriptor, ddc, trim=0.05):
+		"""
+		Prepares a model signal as DDC would see it
+
+		trim	Portion of pulse head+tail to be discarded so as to remove transients
+			Default: 0.05
+		"""
+
+		self.ddc = ddc
+		self.descriptor = descriptor
+
+		sysclk = parse_freq_expr("1 GHz")
+		fstep = sysclk / 2**32
+
+		rate = parse_freq_expr(ddc.samplerate)
+		frames = ddc.frames
+		tune = parse_freq_expr(descriptor.tune)
+
+		capture_duration = frames / rate
+
+		# FIXME: we should just be able to use the level directly if the signal generator really was properly calibrated
+		# As of now it isn't
+		level = parse_volt_expr(descriptor.level) * self.signal_level_factor
+		asf, fsc = ad9910_best_asf_fsc_v1(level)
+		level = ad9910_vrms_v1(asf, fsc) / self.signal_level_factor
+
+		# Chip parameters, quantized the same way PresetInterpreterDDCAndCalibratorV2 does it
+		chips = descriptor.emit
+
+		hold = np.array([ round(parse_time_expr(chip.hold, into="ns")) for chip in chips ]) / 1000 / 1000 / 1000
+		asf = np.array([ round(16383 * float(chip.amplitude)) for chip in chips ])
+		ftw = np.array([ round(parse_freq_expr(chip.frequency) / fstep) for chip in chips ])
+		pow = np.array([ round(65535 * parse_angle_expr(chip.phase, into="deg") / 360.0) for chip in chips ])
+
+		freq = ftw * fstep
+		stops = np.cumsum(hold)
+		starts = stops - hold
+		duration = stops[-1]
+
+		#
+		# Prepare model signal
+		#
+		time = dds.time_series(rate, capture_duration)
+		chip = np.searchsorted(stops, time, side="right")
+		active = chip < len(chips)
+		chip = np.minimum(chip, len(chips) - 1)
+
+		# As the DDC sees it, relative to the tune
+		baseband = freq - tune
+
+		# Phase accumulated by the start of every chip
+		accumulated = 2*np.pi*np.cumsum(baseband * hold) - 2*np.pi*baseband*hold
+
+		phase = accumulated[chip] + 2*np.pi*baseband[chip]*(time - starts[chip]) + 2*np.pi*pow[chip]/65536
+
+		# DDC's perceived signal level
+		amplitude = level * 1000 / ddc_cost_mv(freq) * asf / 16383
+		amplitude /= ad9910_inv_sinc(freq, sysclk=sysclk)
+
+		temporal_freq = np.where(active, baseband[chip], 0.0)
+		spectral_freq = np.linspace(-rate/2, rate/2, frames)
+		model_chips = np.where(active, amplitude[chip] * np.exp(1j*phase), 0.0)
+
+		#
+		# Prepare delay estimator
+		#
+		# Number of bins the pulse body sweeps through, as suggested in ModelSignalV1:
+		# - Sweeps have SpectralDelayEstimator - which assumes contiguous indices_est
+		# - Tones and phase codes have ConvDelayEstimator
+
+		# Establish the frequencies at truncated head/tail
+		start = duration*trim
+		stop = duration*(1-trim)
+
+		temporal_indices = (time >= start) * (time < stop)
+		freqs = temporal_freq[temporal_indices]
+
+		bins_occupied = len( np.unique(freqs - freqs % (rate/frames)) )
+
+		if bins_occupied >= self.min_spectral_bins:
+			indices_est = (spectral_freq >= freqs.min())*(spectral_freq < freqs.max())
+			est = SpectralDelayEstimator(model_chips, indices_est)
+		else:
+			est = ConvDelayEstimator(model_chips)
+
+		self.iq = model_chips
+		self.est = est
+		self.corrector = self.correctors.setdefault(frames, DelayCorrector(frames))
+		self.time = time
+		self.delay = 0.0
+		self.duration = duration
+		self.temporal_freq = temporal_freq
+		self.spectral_freq = spectral_freq